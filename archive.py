@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+from collections import OrderedDict as odict
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compress_gzip(path, level):
+    import gzip
+    return gzip.open(path, 'wb', 9 if level is None else level)
+
+def compress_xz(path, level):
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    return lzma.open(path, 'wb', preset=level)
+
+def compress_zstd(path, level):
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    return compressor.stream_writer(open(path, 'wb'))
+
+# the suffixes that datafiles.COMPRESSED_SUFFIXES can read
+COMPRESSORS = odict([
+    ('.gz', compress_gzip),
+    ('.xz', compress_xz),
+    ('.zst', compress_zstd)
+])
+
+
+def archive_datafile(path, suffix='.gz', level=None):
+    """
+    Replace the datafile path with a compressed one that has the same
+    modification time. Returns the size of the compressed file.
+    """
+    target = path + suffix
+    tmp = target + '.tmp'
+    try:
+        with open(path, 'rb') as f:
+            out = COMPRESSORS[suffix](tmp, level)
+            try:
+                shutil.copyfileobj(f, out, CHUNK_SIZE)
+            finally:
+                out.close()
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    stat = os.stat(path)
+    os.utime(tmp, (stat.st_atime, stat.st_mtime))
+    os.rename(tmp, target)
+    os.remove(path)
+    return os.path.getsize(target)
+
+
+def old_datafiles(measurement_path, days):
+    # the plain datafiles not modified in days
+    limit = time.time() - days * 24 * 3600
+    return sorted(path for path in glob.iglob(
+        os.path.join(measurement_path, 'benchmarks-*.csv'))
+        if os.path.getmtime(path) < limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compress the old datafiles of the measurements in place.')
+    parser.add_argument('input_path')
+    parser.add_argument('-d', '--days', type=float, default=30,
+                        help='compress the datafiles not modified in this many days')
+    parser.add_argument('-f', '--format', choices=[s[1:] for s in COMPRESSORS],
+                        default='gz')
+    parser.add_argument('-l', '--level', type=int, default=None)
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only list the datafiles to compress')
+    args = parser.parse_args()
+
+    paths = old_datafiles(os.path.normpath(args.input_path), args.days)
+    total_before = 0
+    total_after = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if args.dry_run:
+            print path, size
+            continue
+        try:
+            compressed_size = archive_datafile(
+                path, suffix='.' + args.format, level=args.level)
+        except (IOError, OSError, ImportError) as e:
+            print 'Could not compress {}: {}'.format(path, e)
+            sys.exit(1)
+        total_before += size
+        total_after += compressed_size
+        print '{} {} -> {} bytes'.format(path, size, compressed_size)
+    if total_before:
+        print 'Compressed {} datafiles from {} to {} bytes'.format(
+            len(paths), total_before, total_after)
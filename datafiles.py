@@ -1,7 +1,17 @@
 #!/usr/bin/python
 
+import cPickle
+import io
+import operator
+import os
+import random
 import re
+import tempfile
+import threading
+import weakref
+import zipfile
 from collections import OrderedDict as odict
+from itertools import islice
 import sys
 
 SEPARATOR = ','
@@ -24,74 +34,798 @@ def value(string, key=None):
     else:
         return string
 
-def empty_label():
-    empty_label.cnt += 1
-    return 'empty_{0}'.format(empty_label.cnt)
+class DatafileError(Exception):
+    pass
 
-empty_label.cnt = 0
+# the parameter_type_<type>_count columns are mostly empty
+RE_SPARSE = re.compile('^parameter_type_.+_count$')
 
-def read_datafiles(files, silent=False):
-    if not silent:
-        print 'Reading from %s files' % len(files)
+class Missing(object):
+    def __reduce__(self):
+        # unpickles as the same object in the parse workers' results
+        return 'MISSING'
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = Missing()
+
+# repeated strings that are stored as codes of a dictionary
+CATEGORICAL_KEYS = ['id', 'class', 'from', 'to', 'direction', 'return_type', 'single_type']
+
+# the dictionaries are shared by the sessions of every thread
+dictionary_lock = threading.Lock()
+
+class Dictionary(object):
+    """
+    The distinct values of a categorical column. Codes are given in
+    the order of appearance; sort_ranks() gives the sort order of the values.
+    """
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.ranks = None
+        # the results are forgotten with the predicates, which are
+        # often made for one plotting run
+        self.tests = weakref.WeakKeyDictionary()
+
+    def code(self, val):
+        try:
+            return self.codes[val]
+        except KeyError:
+            pass
+        with dictionary_lock:
+            code = self.codes.get(val)
+            if code is None:
+                self.values.append(val)
+                code = self.codes[val] = len(self.values) - 1
+                self.ranks = None
+            return code
+
+    def sort_ranks(self):
+        ranks = self.ranks
+        if ranks is None:
+            with dictionary_lock:
+                order = sorted(range(len(self.values)), key=self.values.__getitem__)
+                ranks = [0] * len(order)
+                for rank, c in enumerate(order):
+                    ranks[c] = rank
+                self.ranks = ranks
+        return ranks
+
+    def test(self, predicate, code):
+        # the predicate is called once per distinct value
+        try:
+            results = self.tests[predicate]
+        except KeyError:
+            with dictionary_lock:
+                results = self.tests.setdefault(predicate, {})
+        try:
+            return results[code]
+        except KeyError:
+            result = results[code] = predicate(self.values[code])
+            return result
+
+def dictionary(key):
+    try:
+        return dictionary.all[key]
+    except KeyError:
+        with dictionary_lock:
+            return dictionary.all.setdefault(key, Dictionary())
+
+dictionary.all = {}
+
+class Schema(object):
+    """
+    The columns of the records read from one datafile, shared by the
+    records. Deleting keys from a record switches it to a schema
+    that hides them.
+    """
+    def __init__(self, labels):
+        self.labels = []
+        self.index = {}
+        self.sparse = {}
+        self.sparse_labels = []
+        self.hidden = frozenset()
+        self.base = self
+        self.derived = {}
+        # the categorical columns with codes instead of values,
+        # set by encode after parsing
+        self.categories = {}
+        for label in labels:
+            self.add(label)
+
+    def add(self, label):
+        if label in self.index or label in self.sparse:
+            return
+        if RE_SPARSE.match(label):
+            self.sparse[label] = len(self.sparse_labels)
+            self.sparse_labels.append(label)
+        else:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+
+    def encode(self, records):
+        """
+        Replace the values of the categorical columns of freshly parsed
+        records with dictionary codes.
+        """
+        columns = []
+        for label in self.labels:
+            if label in CATEGORICAL_KEYS:
+                self.categories[label] = dictionary(label)
+                columns.append((self.index[label], self.categories[label]))
+        for record in records:
+            values = record.values
+            for i, d in columns:
+                if i < len(values):
+                    val = values[i]
+                    if val is not None and val is not MISSING:
+                        values[i] = d.code(val)
+
+    def key_getter(self, keys, ranked):
+        # the values of a record, a None for the missing keys and
+        # the sparse counts are laid out in one list, from which the
+        # keys are picked with an itemgetter
+        width = len(self.labels)
+        slots = []
+        categories = []
+        for j, key in enumerate(keys):
+            if key in self.hidden:
+                slots.append(width)
+            elif key in self.index:
+                slots.append(self.index[key])
+                if ranked and key in self.categories:
+                    categories.append((j, self.categories[key].sort_ranks()))
+            elif key in self.sparse:
+                slots.append(width + 1 + self.sparse[key])
+            else:
+                slots.append(width)
+        getter = operator.itemgetter(*slots) if slots else lambda row: ()
+        single = len(slots) == 1
+        no_sparse = [None] * len(self.sparse_labels)
+
+        def key(record):
+            values = record.values
+            if len(values) < width:
+                values = values + [MISSING] * (width - len(values))
+            sparse = no_sparse
+            if record.counts:
+                sparse = no_sparse[:]
+                for code, count in record.counts:
+                    sparse[code] = count
+            picked = getter(values + [None] + sparse)
+            picked = [picked] if single else list(picked)
+            for j, ranks in categories:
+                code = picked[j]
+                if code is not None and code is not MISSING:
+                    picked[j] = ranks[code]
+            return picked
+        return key
+
+    def with_hidden(self, hidden):
+        base = self.base
+        if hidden == base.hidden:
+            return base
+        try:
+            return base.derived[hidden]
+        except KeyError:
+            schema = Schema.__new__(Schema)
+            schema.__dict__.update(base.__dict__)
+            schema.hidden = hidden
+            schema.derived = None
+            base.derived[hidden] = schema
+            return schema
+
+    def hiding(self, keys):
+        return self.with_hidden(self.hidden.union(keys))
+
+    def showing(self, key):
+        return self.with_hidden(self.hidden - frozenset([key]))
+
+def key_function(keys, ranked=True):
+    """
+    A key function giving the values of the keys of a record as a
+    list, with None for the missing keys. The categorical values are
+    given as their sort ranks if ranked, otherwise as their codes.
+    """
+    keys = list(keys)
+    getters = {}
+    def key(record):
+        schema = record.schema
+        try:
+            getter = getters[schema]
+        except KeyError:
+            getter = getters[schema] = schema.key_getter(keys, ranked)
+        return getter(record)
+    return key
+
+class Record(object):
+    """
+    A benchmark row with the dict interface used by the plotting
+    code. The values are kept in schema order and the sparse type
+    counts as (code, count) pairs of the non-empty ones.
+    """
+    __slots__ = ['schema', 'values', 'counts']
+
+    def __init__(self, schema, values, counts=()):
+        self.schema = schema
+        self.values = values
+        self.counts = counts
+
+    def __getstate__(self):
+        return self.schema, self.values, self.counts
+
+    def __setstate__(self, state):
+        self.schema, self.values, self.counts = state
+
+    def __getitem__(self, key):
+        schema = self.schema
+        if key not in schema.hidden:
+            i = schema.index.get(key)
+            if i is not None:
+                if i < len(self.values):
+                    val = self.values[i]
+                    if val is not MISSING:
+                        if val is not None and key in schema.categories:
+                            return schema.categories[key].values[val]
+                        return val
+            elif key in schema.sparse:
+                code = schema.sparse[key]
+                for c, count in self.counts:
+                    if c == code:
+                        return count
+                return None
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        schema = self.schema
+        if key in schema.hidden:
+            return False
+        i = schema.index.get(key)
+        if i is not None:
+            return i < len(self.values) and self.values[i] is not MISSING
+        return key in schema.sparse
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def code(self, key):
+        """The value, or the dictionary code of a categorical value."""
+        i = self.schema.index.get(key)
+        if i is None or key not in self.schema.categories:
+            return self[key]
+        if key not in self:
+            raise KeyError(key)
+        return self.values[i]
+
+    def matches(self, key, predicate):
+        """predicate(self[key]), once per distinct categorical value."""
+        d = self.schema.categories.get(key)
+        if d is None:
+            return predicate(self[key])
+        code = self.code(key)
+        if code is None:
+            return predicate(None)
+        return d.test(predicate, code)
+
+    def __setitem__(self, key, val):
+        schema = self.schema
+        if key in schema.hidden:
+            self.schema = schema = schema.showing(key)
+        if key not in schema.index and key not in schema.sparse:
+            schema.add(key)
+            if key in CATEGORICAL_KEYS:
+                schema.categories[key] = dictionary(key)
+        if key in schema.categories and val is not None:
+            val = schema.categories[key].code(val)
+        if key in schema.sparse:
+            code = schema.sparse[key]
+            counts = [(c, count) for c, count in self.counts if c != code]
+            if val is not None:
+                counts.append((code, val))
+            self.counts = tuple(counts)
+            return
+        i = schema.index[key]
+        values = self.values
+        if i >= len(values):
+            values.extend([MISSING] * (i + 1 - len(values)))
+        values[i] = val
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.schema = self.schema.hiding([key])
+
+    def keys(self):
+        schema = self.schema
+        hidden = schema.hidden
+        values = self.values
+        keys = [label for label, val in zip(schema.labels, values)
+                if val is not MISSING and label not in hidden]
+        keys.extend(label for label in schema.sparse_labels
+                    if label not in hidden)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return Record(self.schema, list(self.values), self.counts)
+
+    def without(self, keys):
+        """A copy that does not have the keys."""
+        return Record(self.schema.hiding(keys), list(self.values), self.counts)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+# the records written to a spill file at a time
+SPILL_BATCH = 4096
+
+class Spill(object):
+    """
+    Records written into temporary files by partition, to be read
+    back one partition at a time. Only the values are written; the
+    schemas stay in memory.
+    """
+    def __init__(self, partitions, directory=None):
+        self.files = [tempfile.TemporaryFile(prefix='spill-', dir=directory)
+                      for i in range(partitions)]
+        self.buffers = [[] for i in range(partitions)]
+        self.schemas = []
+        self.schema_index = {}
+
+    def add(self, partition, record):
+        schema = record.schema
+        try:
+            s = self.schema_index[schema]
+        except KeyError:
+            s = self.schema_index[schema] = len(self.schemas)
+            self.schemas.append(schema)
+        buf = self.buffers[partition]
+        buf.append((s, record.values, record.counts))
+        if len(buf) >= SPILL_BATCH:
+            self.flush(partition)
+
+    def flush(self, partition):
+        # a new pickler every batch, so that its memo does not grow
+        cPickle.dump(self.buffers[partition], self.files[partition],
+                     cPickle.HIGHEST_PROTOCOL)
+        self.buffers[partition] = []
+
+    def partition(self, partition):
+        """The records of a partition, in the order they were added."""
+        if self.buffers[partition]:
+            self.flush(partition)
+        f = self.files[partition]
+        f.seek(0)
+        records = []
+        schemas = self.schemas
+        while True:
+            try:
+                batch = cPickle.load(f)
+            except EOFError:
+                break
+            records.extend(Record(schemas[s], values, counts)
+                           for s, values, counts in batch)
+        f.close()
+        return records
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+def parse_labels(line):
+    labels = explode(line)
+    empty = 0
+    for i, l in enumerate(labels):
+        # account for the fact that there might be an empty label
+        # and corresponding column (usually the last)
+        if RE_EMPTY.match(l):
+            empty += 1
+            labels[i] = 'empty_{0}'.format(empty)
+    return labels
+
+def parse_rows(labels, lines, name='?', lineno=1, schema=None):
+    """
+    Returns (benchmarks, keys_with_values) of the lines, numbering
+    them from lineno. The records share the schema.
+    """
     benchmarks = []
-    #-1: there is an empty field at the end...
+    keys_with_values = set()
+
+    if schema is None:
+        schema = Schema(['lineno'] + labels)
+    columns = [(key, schema.sparse.get(key)) for key in labels]
+
+    for line in lines:
+        exploded_line = explode(line)
+        pad_amount = len(labels) - len(exploded_line)
+        exploded_line.extend(['-'] * pad_amount)
+        if len(labels) != len(exploded_line):
+            raise DatafileError(
+                'missing values {} line {} labels {} values {}'.format(
+                    name, lineno, len(labels), len(exploded_line)))
+
+        values = [lineno]
+        counts = []
+        for (key, code), string in zip(columns, exploded_line):
+            val = value(string, key=key)
+            if code is None:
+                values.append(val)
+            elif val is not None:
+                counts.append((code, val))
+
+            if val != None:
+                keys_with_values.add(key)
 
+        benchmarks.append(Record(schema, values, tuple(counts)))
+        lineno += 1
+
+    return benchmarks, keys_with_values
+
+def typed_rows(labels, rows, lineno=1, schema=None):
+    """
+    Like parse_rows, for rows (sequences of the values of labels)
+    whose values are already parsed, eg. read from the store.
+    """
+    benchmarks = []
     keys_with_values = set()
-    all_keys = set()
 
-    lineno = 1
-    for i, f in enumerate(files):
-        line = f.readline()
-        labels = explode(line)
-        for i, l in enumerate(labels):
-            # account for the fact that there might be an empty label
-            # and corresponding column (usually the last)
-            if RE_EMPTY.match(l):
-                labels[i] = empty_label()
+    if schema is None:
+        schema = Schema(['lineno'] + labels)
+    columns = [(key, schema.sparse.get(key)) for key in labels]
 
-        all_keys.update(labels)
+    for row in rows:
+        values = [lineno]
+        counts = []
+        for (key, code), val in zip(columns, row):
+            if code is None:
+                values.append(val)
+            elif val is not None:
+                counts.append((code, val))
+
+            if val is not None:
+                keys_with_values.add(key)
 
-        line = f.readline()
-        while line != '':
-            exploded_line = explode(line)
-            pad_amount = len(labels) - len(exploded_line)
-            exploded_line.extend(['-'] * pad_amount)
-            if len(labels) != len(exploded_line):
-                 print 'missing values', f.name, 'line', lineno, 'labels', len(labels), 'values', len(exploded_line)
-                 exit(1)
+        benchmarks.append(Record(schema, values, tuple(counts)))
+        lineno += 1
 
-            benchmark = dict()
-            benchmark['lineno'] = lineno
+    return benchmarks, keys_with_values
 
-            for key, string in zip(labels, exploded_line):
-                benchmark[key] = value(string, key=key)
+# the columns that differ between the rounds of one benchmark
+ROUND_KEYS = ['no', 'start', 'end', 'response_time', 'response_time_millis']
 
-                if value(string, key=key) != None:
-                    keys_with_values.add(key)
+def sample_lines(labels, lines, size, seed=0, fields=explode):
+    """
+    A reservoir sample of up to size lines of every benchmark
+    configuration, ie. of the lines with the same values in all but
+    the ROUND_KEYS. Only the sampled lines need to be parsed. The
+    lines keep their order. fields splits a line into the values of
+    labels.
+    """
+    configuration = operator.itemgetter(
+        *[i for i, label in enumerate(labels) if label not in ROUND_KEYS])
+    rng = random.Random(seed)
+    seen = {}
+    reservoirs = {}
+    for index, line in enumerate(lines):
+        try:
+            key = configuration(fields(line))
+        except IndexError:
+            # parse_rows reports the broken line
+            key = None
+        count = seen[key] = seen.get(key, 0) + 1
+        if count <= size:
+            reservoirs.setdefault(key, []).append((index, line))
+        else:
+            replaced = rng.randrange(count)
+            if replaced < size:
+                reservoirs[key][replaced] = (index, line)
+    return [line for index, line in sorted(
+        sample for reservoir in reservoirs.itervalues() for sample in reservoir)]
 
-            #if benchmark['response_time'] != None:
-            benchmarks.append(benchmark)
+def parse_datafile(f, name=None, sample=None):
+    """
+    Parse the rows of one datafile. Line numbers start from 1 in
+    every file; merge_datafiles renumbers them. With sample, only a
+    sample of that many rows of every configuration is parsed.
+    Returns (labels, benchmarks, keys_with_values).
+    """
+    labels = parse_labels(f.readline())
+    lines = iter(f.readline, '')
+    if sample:
+        lines = sample_lines(labels, lines, sample)
+    benchmarks, keys_with_values = parse_rows(
+        labels, lines, name=name or getattr(f, 'name', '?'))
+    return labels, benchmarks, keys_with_values
+
+def open_gzip(path):
+    import gzip
+    return io.BufferedReader(gzip.open(path, 'rb'))
+
+def open_xz(path):
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    return io.BufferedReader(lzma.open(path, 'rb'))
+
+def open_zstd(path):
+    import zstandard
+    return io.BufferedReader(
+        zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')))
+
+# The datafiles may also be compressed, with one of these suffixes
+# after .csv. The decompressor modules are only needed when such
+# a file is read.
+COMPRESSED_SUFFIXES = odict([
+    ('.gz', open_gzip),
+    ('.xz', open_xz),
+    ('.zst', open_zstd)
+])
+
+RE_DATAFILE = re.compile('^benchmarks-(.+)\.csv$')
+
+def archive_path(path):
+    # the perf data archive that also has the datafile
+    directory, name = os.path.split(path)
+    m = RE_DATAFILE.match(name)
+    if m is None:
+        return None
+    return os.path.join(directory, 'perfdata-{}.zip'.format(m.group(1)))
+
+def datafile_path(path):
+    """
+    The file that has the datafile path: the file itself, a compressed
+    one, or the perf data archive of the measurement. None if there
+    is no such file.
+    """
+    candidates = [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES]
+    zpath = archive_path(path)
+    if zpath:
+        candidates.append(zpath)
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def open_datafile(path):
+    """
+    A stream of the datafile path, decompressed or read from the perf
+    data archive if there is no plain file.
+    """
+    found = datafile_path(path)
+    if found is None:
+        raise IOError('No datafile {}'.format(path))
+    suffix = os.path.splitext(found)[1]
+    if suffix in COMPRESSED_SUFFIXES:
+        return COMPRESSED_SUFFIXES[suffix](found)
+    if suffix == '.zip':
+        archive = zipfile.ZipFile(found, 'r')
+        try:
+            # the members are named after the id on the device
+            for member in archive.namelist():
+                if RE_DATAFILE.match(os.path.basename(member)):
+                    # the member keeps its own handle to the archive
+                    return io.BufferedReader(archive.open(member))
+        finally:
+            archive.close()
+        raise IOError('No datafile in {}'.format(found))
+    return open(found)
+
+def read_datafile(path, sample=None):
+    with open_datafile(path) as f:
+        return parse_datafile(f, name=path, sample=sample)
+
+def merge_datafiles(parts):
+    """
+    Combine parsed datafiles (in file order) into one list of
+    benchmarks, dropping the keys that have no values in any file.
+    """
+    benchmarks = []
+    keys_with_values = set()
+    all_keys = set()
 
-            line = f.readline()
-            lineno += 1
+    lineno = 0
+    for labels, rows, with_values in parts:
+        if rows:
+            rows[0].schema.encode(rows)
+        all_keys.update(labels)
+        keys_with_values.update(with_values)
+        for benchmark in rows:
+            benchmark['lineno'] += lineno
+        lineno += len(rows)
+        benchmarks.extend(rows)
 
     keys_without_values = all_keys - keys_with_values
+    if keys_without_values:
+        benchmarks = [b.without(keys_without_values) for b in benchmarks]
 
     benchmark_keycount = None
     for benchmark in benchmarks:
-        for key in keys_without_values:
-            if key in benchmark:
-                del benchmark[key]
-        current_keycount = len(benchmark.keys())
+        current_keycount = len(benchmark)
         benchmark_keycount = benchmark_keycount or current_keycount
         if benchmark_keycount != current_keycount:
-            print "Benchmarks have different amount of data", benchmark_keycount, current_keycount, "at line", benchmark['lineno']
-            exit(1)
+            raise DatafileError(
+                "Benchmarks have different amount of data {} {} at line {}".format(
+                    benchmark_keycount, current_keycount, benchmark['lineno']))
+
+    return benchmarks
+
+def read_datafiles(files, silent=False):
+    if not silent:
+        print 'Reading from %s files' % len(files)
+    benchmarks = merge_datafiles([parse_datafile(f) for f in files])
 
     if not silent:
-        print 'Read %d lines' % (lineno - 1)
+        print 'Read %d lines' % len(benchmarks)
     return benchmarks
 
+def count_rows(paths):
+    """The number of benchmark rows in the datafiles, without parsing them."""
+    count = 0
+    for path in paths:
+        with open_datafile(path) as f:
+            count += max(sum(1 for line in f) - 1, 0)
+    return count
+
+class SpilledDatafiles(object):
+    """
+    The benchmarks of datafiles like read_datafiles reads them, parsed
+    straight into a Spill so that they are never all in memory. All
+    the rounds of a benchmark configuration (the rows with the same
+    values in all but the ROUND_KEYS) are in the same partition.
+    """
+    def __init__(self, paths, partitions, directory=None):
+        self.spill = Spill(partitions, directory)
+        self.count = partitions
+        self.rows = 0
+        keys_with_values = set()
+        all_keys = set()
+        try:
+            for path in paths:
+                with open_datafile(path) as f:
+                    labels = parse_labels(f.readline())
+                    all_keys.update(labels)
+                    schema = Schema(['lineno'] + labels)
+                    configuration = key_function(
+                        [l for l in labels if l not in ROUND_KEYS], ranked=False)
+                    lines = iter(f.readline, '')
+                    lineno = 1
+                    while True:
+                        batch = list(islice(lines, SPILL_BATCH))
+                        if not batch:
+                            break
+                        rows, with_values = parse_rows(
+                            labels, batch, name=path, lineno=lineno, schema=schema)
+                        lineno += len(rows)
+                        keys_with_values.update(with_values)
+                        # partitioned by the values before they are encoded
+                        targets = [hash(tuple(configuration(b))) % partitions
+                                   for b in rows]
+                        schema.encode(rows)
+                        for target, benchmark in zip(targets, rows):
+                            # numbered like merge_datafiles numbers them
+                            benchmark['lineno'] += self.rows
+                            self.spill.add(target, benchmark)
+                    self.rows += lineno - 1
+        except:
+            self.spill.close()
+            raise
+        self.keys_without_values = all_keys - keys_with_values
+
+    def partitions(self):
+        """
+        The benchmarks of every partition in turn, without the keys
+        that have no values in any datafile. Each partition can be
+        read once.
+        """
+        benchmark_keycount = None
+        for i in range(self.count):
+            benchmarks = self.spill.partition(i)
+            if self.keys_without_values:
+                benchmarks = [b.without(self.keys_without_values) for b in benchmarks]
+            for benchmark in benchmarks:
+                current_keycount = len(benchmark)
+                benchmark_keycount = benchmark_keycount or current_keycount
+                if benchmark_keycount != current_keycount:
+                    raise DatafileError(
+                        "Benchmarks have different amount of data {} {} at line {}".format(
+                            benchmark_keycount, current_keycount, benchmark['lineno']))
+            yield benchmarks
+
+    def close(self):
+        self.spill.close()
+
+def minimum_records(benchmarks, measure='response_time'):
+    """
+    One benchmark per configuration of benchmarks, like
+    store.read_minimums reads them: the round with the minimum of
+    measure, with the number of rounds in rounds.
+    """
+    if not benchmarks:
+        return []
+    configuration = key_function(
+        [key for key in benchmarks[0].keys()
+         if key not in ROUND_KEYS and key != 'lineno'],
+        ranked=False)
+    minimums = odict()
+    for benchmark in benchmarks:
+        key = tuple(configuration(benchmark))
+        found = minimums.get(key)
+        if found is None:
+            minimums[key] = [benchmark, 1]
+        else:
+            found[1] += 1
+            if benchmark[measure] < found[0][measure]:
+                found[0] = benchmark
+    result = []
+    for benchmark, rounds in minimums.itervalues():
+        benchmark = benchmark.copy()
+        benchmark['rounds'] = rounds
+        result.append(benchmark)
+    return result
+
+class DatafileTail(object):
+    """
+    Follows a datafile that is still being written. Every read()
+    parses only the complete rows appended since the previous one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.labels = None
+        self.schema = None
+        self.lineno = 1
+        self.keys_with_values = set()
+
+    def read(self):
+        """
+        Returns the new benchmarks, an empty list if there are none or
+        the file does not exist yet.
+        """
+        try:
+            f = open(self.path)
+        except IOError:
+            return []
+        try:
+            f.seek(self.offset)
+            data = f.read()
+        finally:
+            f.close()
+
+        # a partially written last line is left for the next read
+        end = data.rfind('\n') + 1
+        if end == 0:
+            return []
+        self.offset += end
+        lines = data[:end].splitlines(True)
+        if self.labels is None:
+            self.labels = parse_labels(lines.pop(0))
+            self.schema = Schema(['lineno'] + self.labels)
+        benchmarks, keys_with_values = parse_rows(
+            self.labels, lines, name=self.path, lineno=self.lineno,
+            schema=self.schema)
+        self.schema.encode(benchmarks)
+        self.lineno += len(benchmarks)
+        self.keys_with_values.update(keys_with_values)
+        return benchmarks
+
 def read_measurement_metadata(mfile, combine_compatibles):
     compatibles = odict()
     measurement = None
@@ -116,12 +850,13 @@ def read_measurement_metadata(mfile, combine_compatibles):
                 cpufreq = measurement.get('cpu-freq')
                 benchmark_set = measurement.get('benchmark-set')
                 substring_filter = measurement.get('substring-filter')
+                device = measurement.get('device')
                 if measurement.get('rounds') == None:
                     measurement['rounds'] = 1
                 
                 if revision and repetitions:
                     if combine_compatibles:
-                        key = (revision, checksum, repetitions, tool, cpufreq, benchmark_set, substring_filter)
+                        key = (revision, checksum, repetitions, tool, cpufreq, benchmark_set, substring_filter, device)
                     else:
                         key = i
                         i += 1
@@ -140,3 +875,71 @@ def read_measurement_metadata(mfile, combine_compatibles):
         line = mfile.readline()        
 
     return compatibles
+
+NAMESPACED_KEYS = ['id', 'logfile']
+
+def measurement_blocks(mfile):
+    # the lines of every measurement of the metadata
+    block = []
+    for line in mfile:
+        if line.strip() == '':
+            if block:
+                yield block
+            block = []
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        block.append(line)
+    if block:
+        yield block
+
+def block_value(block, key):
+    for line in block:
+        splitted = line.split()
+        if len(splitted) > 1 and splitted[0].rstrip(':') == key:
+            return ' '.join(splitted[1:]).strip()
+    return None
+
+def namespace_measurement_metadata(mfile, out, device, exclude=()):
+    """
+    Copy the measurement metadata of one device to out, adding the
+    device to every measurement and prefixing the ids and logfiles
+    with it. The original values are kept as device-id and
+    device-logfile. The measurements with the ids in exclude are
+    left out.
+    """
+    for block in measurement_blocks(mfile):
+        if block_value(block, 'id') in exclude:
+            continue
+        # every measurement block must be preceded by an empty line
+        out.write('\ndevice: {}\n'.format(device))
+        for line in block:
+            splitted = line.split()
+            key = splitted[0].rstrip(':')
+            if key in NAMESPACED_KEYS and len(splitted) > 1:
+                val = ' '.join(splitted[1:]).strip()
+                out.write('device-{}: {}\n'.format(key, val))
+                out.write('{}: {}-{}\n'.format(key, device, val))
+            else:
+                out.write(line)
+    out.write('\n\n')
+
+def copy_measurement_metadata(mfile, out, devices={}):
+    """
+    Copy the measurement metadata as it is, adding the devices (a
+    dict of the ids) to the measurements without one. Returns the
+    (device, id) of every measurement.
+    """
+    measurements = []
+    for block in measurement_blocks(mfile):
+        mid = block_value(block, 'id')
+        device = block_value(block, 'device')
+        out.write('\n')
+        if device is None and devices.get(mid) is not None:
+            device = devices[mid]
+            out.write('device: {}\n'.format(device))
+        for line in block:
+            out.write(line)
+        measurements.append((device, mid))
+    out.write('\n\n')
+    return measurements
@@ -0,0 +1,368 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import time
+from collections import namedtuple
+from collections import OrderedDict as odict
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from subprocess import call, check_output, CalledProcessError
+
+from datafiles import read_datafile, merge_datafiles, DatafileError
+from datafiles import namespace_measurement_metadata, copy_measurement_metadata
+from datafiles import datafile_path, measurement_blocks, block_value
+
+# The adb executable can be replaced with a stub script for testing.
+ADB = os.getenv('ADB', 'adb')
+SYNC_WORKERS = 4
+
+# Per-device copies of the measurement metadata are kept under
+# <host_path>/devices/<serial>/
+DEVICES_DIR = 'devices'
+# The index of the single device mode is kept under this suffix when
+# the devices are first synced separately
+LEGACY_SUFFIX = '.single'
+
+# A file to pull from the device with the given serial (None: the
+# only attached device), stored locally under another name.
+Transfer = namedtuple('Transfer', ['serial', 'remote', 'local'])
+
+
+def as_transfer(filename):
+    if isinstance(filename, Transfer):
+        return filename
+    return Transfer(None, filename, filename)
+
+
+def list_devices():
+    try:
+        output = check_output([ADB, 'devices'])
+    except (OSError, CalledProcessError):
+        return []
+    serials = []
+    for line in output.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == 'device':
+            serials.append(parts[0])
+    return serials
+
+
+def adb_pull(remote_path, local_path, serial=None):
+    command = [ADB]
+    if serial is not None:
+        command.extend(['-s', serial])
+    command.extend(['pull', remote_path, local_path])
+    devnull = open(os.devnull, 'w')
+    try:
+        return call(command, stdout=devnull, stderr=devnull)
+    except OSError:
+        return -1
+    finally:
+        devnull.close()
+
+
+def tmp_path(transfer):
+    if transfer.serial is None:
+        return '/tmp/' + transfer.local
+    return '/tmp/{}-{}'.format(transfer.serial, transfer.local)
+
+
+def update_file(dev_path, host_path, filename):
+    """
+    Pull a file, replacing the local copy unless the device copy
+    is smaller. Returns 'updated', 'shrunk' or 'failed'.
+    """
+    transfer = as_transfer(filename)
+    old_path = os.path.join(host_path, transfer.local)
+    new_path = tmp_path(transfer)
+
+    if adb_pull(dev_path + '/' + transfer.remote, new_path,
+                serial=transfer.serial) != 0:
+        return 'failed'
+    if os.path.exists(old_path):
+        size_new = os.path.getsize(new_path)
+        size_old = os.path.getsize(old_path)
+        if size_new < size_old:
+            return 'shrunk'
+    shutil.move(new_path, old_path)
+    return 'updated'
+
+
+def sync_measurements(dev_path, host_path, filename, update=True, serial=None):
+    old_path = host_path + '/' + filename
+    if not update and os.path.exists(old_path):
+        print 'No sync necessary'
+        return
+
+    status = update_file(
+        dev_path, host_path, Transfer(serial, filename, filename))
+    if status == 'shrunk':
+        raise DatafileError(
+            'The new {} contains less data than the old, aborting.'.format(
+                filename))
+    elif status == 'failed':
+        print "Could not get new measurements, continuing with old."
+
+
+def sync_devices(dev_path, host_path, filename, serials,
+                 workers=SYNC_WORKERS, pool=None):
+    """
+    Pull the measurement metadata from every device concurrently and
+    merge all the device copies into one index at host_path/filename.
+    Measurement ids are prefixed with the device serial; use
+    measurement_files to find the device files of a measurement.
+
+    The measurements of an index synced from the only attached device
+    keep their ids, so that their local files still match. They are
+    assigned to the device whose copy has them (see
+    assign_legacy_devices) and left out of its copy.
+    """
+    devices_path = os.path.join(host_path, DEVICES_DIR)
+    index_path = os.path.join(host_path, filename)
+    legacy_path = index_path + LEGACY_SUFFIX
+    if (not os.path.isdir(devices_path) and os.path.exists(index_path)
+            and not os.path.exists(legacy_path)):
+        shutil.copyfile(index_path, legacy_path + '.tmp')
+        os.rename(legacy_path + '.tmp', legacy_path)
+
+    def pull(serial):
+        device_path = os.path.join(devices_path, serial)
+        if not os.path.isdir(device_path):
+            os.makedirs(device_path)
+        return serial, update_file(
+            dev_path, device_path, Transfer(serial, filename, filename))
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(max(1, min(workers, len(serials))))
+    try:
+        for serial, status in pool.imap(pull, serials):
+            if status == 'shrunk':
+                print "Warning: {} has less data than before, keeping the old.".format(serial)
+            elif status == 'failed':
+                print "Could not get new measurements from {}, continuing with old.".format(serial)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    # devices synced earlier are kept in the index even when detached
+    if not os.path.isdir(devices_path):
+        return
+    copies = odict()
+    for serial in sorted(os.listdir(devices_path)):
+        path = os.path.join(devices_path, serial, filename)
+        if os.path.exists(path):
+            with open(path) as mfile:
+                copies[serial] = set(
+                    block_value(block, 'id') for block in measurement_blocks(mfile))
+
+    legacy = []
+    if os.path.exists(legacy_path):
+        legacy = assign_legacy_devices(legacy_path, copies)
+    with open(index_path, 'w') as index:
+        if os.path.exists(legacy_path):
+            with open(legacy_path) as mfile:
+                copy_measurement_metadata(mfile, index)
+        for serial in copies:
+            path = os.path.join(devices_path, serial, filename)
+            with open(path) as mfile:
+                namespace_measurement_metadata(
+                    mfile, index, serial,
+                    exclude=set(mid for device, mid in legacy
+                                if device in [None, serial]))
+
+
+def assign_legacy_devices(legacy_path, copies):
+    """
+    Add the device to the measurements of the single device index
+    that don't have one yet: the device whose copy (copies maps the
+    serials to their measurement ids) has the measurement, or the
+    only device synced so far. Without a device, adb could not tell
+    which of several devices to pull their files from. Returns the
+    (device, id) of every measurement.
+    """
+    with open(legacy_path) as mfile:
+        unassigned = [block_value(block, 'id') for block in measurement_blocks(mfile)
+                      if block_value(block, 'device') is None]
+    devices = {}
+    for mid in unassigned:
+        found = [serial for serial, ids in copies.iteritems() if mid in ids]
+        if found:
+            devices[mid] = found[0]
+        elif len(copies) == 1:
+            devices[mid] = copies.keys()[0]
+    with open(legacy_path) as mfile:
+        with open(legacy_path + '.tmp', 'w') as out:
+            measurements = copy_measurement_metadata(mfile, out, devices)
+    os.rename(legacy_path + '.tmp', legacy_path)
+    return measurements
+
+
+def measurement_files(measurement):
+    """
+    The transfers for the datafile (or perf data archive) and the
+    logfile of one measurement.
+    """
+    if 'LinuxPerfRecordTool' in measurement['tool']:
+        basename = "perfdata-{n}.zip"
+    else:
+        basename = "benchmarks-{n}.csv"
+    serial = measurement.get('device')
+    device_id = measurement.get('device-id', measurement['id'])
+
+    files = [Transfer(serial,
+                      basename.format(n=device_id),
+                      basename.format(n=measurement['id']))]
+    if 'logfile' in measurement:
+        files.append(Transfer(serial,
+                              measurement.get('device-logfile', measurement['logfile']),
+                              measurement['logfile']))
+    return files
+
+
+def missing_files(host_path, filenames):
+    # archived datafiles are not pulled again
+    return [t for t in map(as_transfer, filenames)
+            if datafile_path(os.path.join(host_path, t.local)) is None]
+
+
+def pull_missing_file(dev_path, host_path, transfer):
+    # Returns the local name and the size of the pulled file, or the
+    # name and None if the pull failed.
+    new_path = tmp_path(transfer)
+    if adb_pull(dev_path + '/' + transfer.remote, new_path,
+                serial=transfer.serial) != 0:
+        return transfer.local, None
+    size = os.path.getsize(new_path)
+    shutil.move(new_path, os.path.join(host_path, transfer.local))
+    return transfer.local, size
+
+
+def sync_files(dev_path, host_path, filenames,
+               workers=SYNC_WORKERS, pool=None, silent=False):
+    """
+    Pull all of the files that are not yet present at host_path,
+    running up to `workers` adb transfers at a time. The files are
+    names or Transfers. A thread pool may be passed in to share it
+    between several batches.
+
+    Returns the list of files that could not be pulled.
+    """
+    missing = missing_files(host_path, filenames)
+    if len(missing) == 0:
+        if not silent:
+            print 'No sync necessary'
+        return []
+
+    if not silent:
+        print 'Pulling %d of %d files' % (len(missing), len(filenames))
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(min(workers, len(missing)))
+
+    failed = []
+    transferred = 0
+    start = time.time()
+    try:
+        results = pool.imap_unordered(
+            partial(pull_missing_file, dev_path, host_path), missing)
+        for done, (filename, size) in enumerate(results, 1):
+            if size is None:
+                failed.append(filename)
+                status = 'failed'
+            else:
+                transferred += size
+                status = '%d bytes' % size
+            if not silent:
+                elapsed = max(time.time() - start, 0.001)
+                print '[{}/{}] {} {} ({:.1f} KiB/s)'.format(
+                    done, len(missing), filename, status,
+                    transferred / 1024.0 / elapsed)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    if failed and not silent:
+        print "Could not get %d files, continuing with old." % len(failed)
+    return failed
+
+
+def ingest_datafiles(dev_path, host_path, filenames, datafiles,
+                     workers=SYNC_WORKERS, pool=None, parse_pool=None,
+                     silent=False, sample=None):
+    """
+    Sync `filenames` like sync_files and read the benchmarks from the
+    `datafiles` (local names) among them. Each datafile is handed to the parse pool
+    as soon as it is available locally, so parsing overlaps with the
+    remaining transfers. With sample, only that many rows of every
+    benchmark configuration are read (see datafiles.sample_lines).
+    """
+    if not silent:
+        print 'Reading from %s files' % len(datafiles)
+
+    own_parse_pool = parse_pool is None
+    if own_parse_pool:
+        parse_pool = Pool()
+
+    parts = {}
+    def parsed(index, part):
+        parts[index] = part
+
+    pending = []
+    def submit(filename):
+        if filename in datafiles:
+            index = datafiles.index(filename)
+            pending.append(parse_pool.apply_async(
+                read_datafile, (os.path.join(host_path, filename), sample),
+                callback=partial(parsed, index)))
+
+    missing = missing_files(host_path, filenames)
+    try:
+        missing_names = [t.local for t in missing]
+        for transfer in map(as_transfer, filenames):
+            if transfer.local not in missing_names:
+                submit(transfer.local)
+
+        if missing:
+            own_pool = pool is None
+            if own_pool:
+                pool = ThreadPool(min(workers, len(missing)))
+            try:
+                results = pool.imap_unordered(
+                    partial(pull_missing_file, dev_path, host_path), missing)
+                for done, (filename, size) in enumerate(results, 1):
+                    if size is None:
+                        if filename in datafiles:
+                            raise IOError(
+                                'Could not get datafile {}'.format(filename))
+                        if not silent:
+                            print 'Could not get {}, continuing.'.format(
+                                filename)
+                        continue
+                    if not silent:
+                        print '[{}/{}] {} {} bytes'.format(
+                            done, len(missing), filename, size)
+                    submit(filename)
+            finally:
+                if own_pool:
+                    pool.close()
+                    pool.join()
+
+        for result in pending:
+            # re-raises a DatafileError from the worker
+            result.get()
+        benchmarks = merge_datafiles(
+            [parts[i] for i in range(len(datafiles))])
+    finally:
+        if own_parse_pool:
+            parse_pool.close()
+            parse_pool.join()
+
+    if not silent:
+        print 'Read %d lines' % len(benchmarks)
+    return benchmarks
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+import argparse
+import mmap
+import operator
+import re
+import sys
+from collections import OrderedDict as odict
+
+from datafiles import explode, value, open_datafile, SEPARATOR
+import textualtable
+
+def contains(left, right):
+    return left is not None and str(right) in str(left)
+
+# the longer operators first
+OPERATORS = odict([
+    ('!=', operator.ne),
+    ('<=', operator.le),
+    ('>=', operator.ge),
+    ('=', operator.eq),
+    ('<', operator.lt),
+    ('>', operator.gt),
+    ('~', contains)
+])
+
+RE_FILTER = re.compile(r'^([^!<>=~]+)({})(.*)$'.format(
+    '|'.join(re.escape(op) for op in OPERATORS)))
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) / 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+# The aggregates are kept up to date as the rows stream past: each
+# takes the state of a group (None before the first value) and the
+# next value. Only the median needs all the values.
+def running_min(state, val):
+    return val if state is None or val < state else state
+
+def running_max(state, val):
+    return val if state is None or val > state else state
+
+def running_count(state, val):
+    return 1 if state is None else state + 1
+
+def collect(state, val):
+    if state is None:
+        return [val]
+    state.append(val)
+    return state
+
+# the running aggregate and the function of its final state
+AGGREGATES = {
+    'min': (running_min, None),
+    'max': (running_max, None),
+    'median': (collect, median),
+    'count': (running_count, None)
+}
+
+class ColumnFile(object):
+    """
+    A memory-mapped datafile. The position of every column is looked
+    up from the header once, and the rows are only split and
+    converted for the requested columns. Compressed and archived
+    datafiles are streamed instead, once per query.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open_datafile(path)
+        if isinstance(self.f, file):
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = self.map.readline()
+            self.data_offset = self.map.tell()
+        else:
+            header = self.f.readline()
+            self.f.close()
+            self.f = self.map = None
+        self.labels = [l.strip() for l in explode(header)]
+        self.columns = dict((label, i) for i, label in enumerate(self.labels) if label)
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError('No field {} in {}'.format(name, self.path))
+
+    def lines(self):
+        if self.map is not None:
+            self.map.seek(self.data_offset)
+            return iter(self.map.readline, '')
+        return self.stream_lines()
+
+    def stream_lines(self):
+        f = open_datafile(self.path)
+        try:
+            f.readline()
+            for line in iter(f.readline, ''):
+                yield line
+        finally:
+            f.close()
+
+    def rows(self, names):
+        indices = [self.column(name) for name in names]
+        # the same strings repeat a lot in most columns
+        converted = [{} for name in names]
+        columns = zip(indices, names, converted)
+        # the line is split only up to the last requested column
+        splits = max(indices) + 1 if indices else 0
+        for line in self.lines():
+            fields = line.rstrip('\r\n').split(SEPARATOR, splits)
+            row = []
+            for i, name, cache in columns:
+                if i >= len(fields):
+                    row.append(None)
+                    continue
+                string = fields[i]
+                try:
+                    row.append(cache[string])
+                except KeyError:
+                    val = cache[string] = value(string, key=name)
+                    row.append(val)
+            yield row
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.f.close()
+
+def parse_filter(expression):
+    m = RE_FILTER.match(expression)
+    if not m:
+        raise ValueError('Invalid filter {}'.format(expression))
+    name, op, operand = m.groups()
+    if op == '~':
+        return name, OPERATORS[op], operand
+    return name, OPERATORS[op], value(operand, key=name)
+
+def parse_aggregate(expression):
+    # min:column, median:column or count
+    function, _, name = expression.partition(':')
+    if function not in AGGREGATES or (function != 'count' and not name):
+        raise ValueError('Invalid aggregate {}'.format(expression))
+    return function, name or None
+
+def display(val):
+    if val is None:
+        return 'X'
+    return val
+
+def query(cfile, fields=[], filters=[], group_by=[], aggregates=[], limit=None):
+    """
+    Returns the headers and rows of a projection of the datafile,
+    or of the aggregates of the groups if aggregates are given.
+    """
+    needed = []
+    for name in (list(fields) + [f[0] for f in filters] + list(group_by) +
+                 [a[1] for a in aggregates if a[1]]):
+        if name not in needed:
+            needed.append(name)
+    position = dict((name, i) for i, name in enumerate(needed))
+    filters = [(position[name], op, operand) for name, op, operand in filters]
+
+    def selected(rows):
+        for row in rows:
+            for i, op, operand in filters:
+                if not op(row[i], operand):
+                    break
+            else:
+                yield row
+
+    if not aggregates and not group_by:
+        rows = []
+        projection = [position[name] for name in fields]
+        for row in selected(cfile.rows(needed)):
+            rows.append([display(row[i]) for i in projection])
+            if limit and len(rows) >= limit:
+                break
+        return fields, rows
+
+    if not aggregates:
+        aggregates = [('count', None)]
+    key_positions = [position[name] for name in group_by]
+    # a count without a field counts the rows, the others skip the
+    # missing values
+    updates = [(AGGREGATES[function][0], position[name] if name else None)
+                for function, name in aggregates]
+    groups = {}
+    for row in selected(cfile.rows(needed)):
+        key = tuple(row[i] for i in key_positions)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = [None] * len(updates)
+        for j, (update, i) in enumerate(updates):
+            if i is None:
+                states[j] = update(states[j], None)
+            elif row[i] is not None:
+                states[j] = update(states[j], row[i])
+
+    headers = list(group_by) + [
+        '{}({})'.format(function, name or '') for function, name in aggregates]
+    finals = [AGGREGATES[function][1] for function, name in aggregates]
+    rows = []
+    for key in sorted(groups.iterkeys()):
+        row = [display(k) for k in key]
+        for final, state in zip(finals, groups[key]):
+            if final is not None and state is not None:
+                state = final(state)
+            row.append(display(state))
+        rows.append(row)
+        if limit and len(rows) >= limit:
+            break
+    return headers, rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query the columns of a benchmark datafile.')
+    parser.add_argument('filename')
+    parser.add_argument('fields', nargs='*',
+                        help='fields to show; without fields, list the available ones')
+    parser.add_argument('-w', '--where', action='append', default=[],
+                        help='filter: field=value, field!=value, field<value, '
+                             'field<=value, field>value, field>=value or field~substring')
+    parser.add_argument('-g', '--group-by', action='append', default=[])
+    parser.add_argument('-a', '--aggregate', action='append', default=[],
+                        help='min:field, max:field, median:field or count')
+    parser.add_argument('-n', '--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    cfile = ColumnFile(args.filename)
+    try:
+        if not (args.fields or args.group_by or args.aggregate):
+            print 'Available fields to use as further parameters'
+            print '(separate several fields with spaces)'
+            for label in cfile.labels:
+                if label:
+                    print label
+            sys.exit(0)
+
+        try:
+            headers, rows = query(
+                cfile,
+                fields=args.fields,
+                filters=[parse_filter(f) for f in args.where],
+                group_by=[g for arg in args.group_by for g in arg.split(',')],
+                aggregates=[parse_aggregate(a) for a in args.aggregate],
+                limit=args.limit)
+        except (KeyError, ValueError) as e:
+            print e.args[0]
+            sys.exit(1)
+        sys.stdout.write(textualtable.make_textual_table(headers, rows))
+    finally:
+        cfile.close()
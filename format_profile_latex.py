@@ -1,26 +1,22 @@
 #!/usr/bin/python
-import sys
-import re
+import argparse
 import codecs
+import os
+import re
+import sys
+from multiprocessing import Pool
 
 RE = {
     'indentation': '[ ]{10}',
-    'comment': '^#',
     'dashes': '--+',
-    'pipes': '^([ |]+)',
-    'percentage': '(\D+)(\d+\.\d+)%',
-    'symbol': '^([^%]+%)* ([^%]+)$'
+    # one match per line: a comment, or the pipes of the call graph
+    # followed by an optional percentage and the symbol
+    'line': r'^(?:(?P<comment>#.*)|(?P<pipes>[ |]*)(?:\D*?(?P<percentage>\d+\.\d+)%)?(?P<symbol>.*))$'
 }
 
 VSPACE = r"(*@\vspace{-0.15cm}@*)"
 
-RE['pipes_only'] = RE['pipes'] + '$'
-for k, v in RE.iteritems():
-    RE[k] = re.compile(v)
-
-def format_to_latex(filename):
-    f = codecs.open(filename, 'r', 'utf8')
-    print r"""
+HEADER = r"""
 \lstset{
   basicstyle=\linespread{0}\rmfamily\tiny,
   escapeinside={(*@}{@*)},
@@ -31,59 +27,149 @@ def format_to_latex(filename):
   moredelim=[is][\underbar]{<<@<<}{>>@>>}
 }
 \begin{lstlisting}
+
+"""
+
+FOOTER = """
+\end{lstlisting}
+
 """
+
+for k, v in RE.iteritems():
+    RE[k] = re.compile(v)
+
+def convert(lines, threshold=None, max_depth=None):
+    """
+    Yield the LaTeX listing of a perf report line by line. The
+    subtrees under percentages below threshold or deeper than
+    max_depth branches (0: only the report entries) are left out.
+    """
+    yield HEADER
+
     def p(line):
-        print line.rstrip().encode('utf8')
-        print VSPACE
+        return line.rstrip() + '\n' + VSPACE + '\n'
 
-    for line in f:
+    branch_columns = []
+    prune_column = None
+    prune_depth = None
+    # pipes-only lines are held back until the next line shows
+    # that the branch below them is not pruned
+    separators = []
+
+    for line in lines:
+        # report entries start with their percentage, call graph
+        # branches with pipes or dashes
+        entry = line.lstrip(' ')[:1].isdigit()
         line = RE['dashes'].sub('', line)
         line = RE['indentation'].sub('       ', line)
-        if RE['comment'].match(line):
+        m = RE['line'].match(line.rstrip('\r\n'))
+        if m.group('comment'):
             continue
-        if RE['pipes_only'].match(line):
-            p(line)
-            p(line)
+
+        pipe_part = m.group('pipes')
+        percentage_value = m.group('percentage')
+        symbol = m.group('symbol').strip()
+        column = len(pipe_part)
+
+        if prune_column is not None:
+            blank = not (pipe_part.strip() or percentage_value or symbol)
+            if column > prune_column or (blank and prune_depth == 0):
+                continue
+            prune_column = None
+
+        if percentage_value:
+            if entry:
+                branch_columns = []
+            while branch_columns and branch_columns[-1] >= column:
+                branch_columns.pop()
+            depth = len(branch_columns)
+            branch_columns.append(column)
+            if ((threshold is not None and float(percentage_value) < threshold) or
+                    (max_depth is not None and depth > max_depth)):
+                prune_column = column
+                prune_depth = depth
+                separators = []
+                continue
+
+        if pipe_part and not percentage_value and not symbol:
+            # pipes only
+            separators.append(p(line))
+            separators.append(p(line))
             continue
 
-        pipe_part = None
-        m = RE['pipes'].match(line)
-        if m: pipe_part = m.group(1)
-        else: pipe_part = None
+        for separator in separators:
+            yield separator
+        separators = []
 
         percentage = ""
-        m = RE['percentage'].search(line)
-        if m:
-            percentage_value = m.group(2)
+        if percentage_value:
             if len(percentage_value) < 5:
                 phantom = '00'
             else:
                 phantom = '0'
             percentage = '$\\underline{{\\phantom{{{}}}{}\\%}}$'.format(phantom,percentage_value)
 
-        symbol = "\n"
-        m = RE['symbol'].match(line)
-        if m: symbol = m.group(2).strip()
+        if not symbol:
+            symbol = "\n"
 
         #$ \underline{\phantom{ab}46.21\%  dvmDecodeIndirectRef(Thread*, \_jobject*)} $
         pipe_part_f = pipe_part
-        if pipe_part_f == None:
-            pipe_part_f = ''
         if len(pipe_part_f.strip()) == 0:
             pipe_part_f = pipe_part_f[:-1] + '|'
-         
-        print "{}{} {}".format(pipe_part_f,percentage, symbol)
-        if pipe_part == None or len(pipe_part.strip()) == 0:
-            print
-            continue
-        print VSPACE
 
-    print """
-\end{lstlisting}
-"""
+        yield u"{}{} {}\n".format(pipe_part_f, percentage, symbol)
+        if len(pipe_part.strip()) == 0:
+            yield "\n"
+        else:
+            yield VSPACE + "\n"
+
+    for separator in separators:
+        yield separator
+    yield FOOTER
+
+def format_to_latex(filename, out=sys.stdout, threshold=None, max_depth=None):
+    f = codecs.open(filename, 'r', 'utf8')
+    try:
+        for chunk in convert(f, threshold=threshold, max_depth=max_depth):
+            out.write(chunk.encode('utf8'))
+    finally:
+        f.close()
 
-    f.close()
+def format_file(job):
+    filename, output_filename, threshold, max_depth = job
+    with open(output_filename, 'w') as out:
+        format_to_latex(filename, out=out, threshold=threshold, max_depth=max_depth)
+    return output_filename
 
 if __name__ == '__main__':
-    filename = sys.argv[1]
-    format_to_latex(filename)
+    parser = argparse.ArgumentParser(
+        description='Convert perf report call graphs into LaTeX listings.')
+    parser.add_argument('reports', nargs='+')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='leave out call graph branches below this percentage')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='leave out call graph branches nested deeper than this')
+    parser.add_argument('--output-dir', default=None,
+                        help='write <report>.tex files here (default: next to the '
+                             'reports, or stdout for a single report)')
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    if len(args.reports) == 1 and args.output_dir is None:
+        format_to_latex(args.reports[0], threshold=args.threshold, max_depth=args.depth)
+        sys.exit(0)
+
+    jobs = []
+    for filename in args.reports:
+        directory = args.output_dir or os.path.dirname(filename)
+        base = os.path.splitext(os.path.basename(filename))[0]
+        jobs.append((filename, os.path.join(directory, base + '.tex'),
+                     args.threshold, args.depth))
+
+    pool = Pool(args.jobs)
+    try:
+        for output_filename in pool.imap(format_file, jobs):
+            print output_filename
+    finally:
+        pool.close()
+        pool.join()
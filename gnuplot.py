@@ -1,8 +1,13 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import abc
 import os
 import uuid
+from subprocess import Popen, PIPE
+
+from session import current
+from units import seconds_rows
 
 INIT_PALETTE = """
 # line styles for ColorBrewer Dark2
@@ -117,20 +122,20 @@ set key {key_placement} box notitle width -3 height +1 vertical
 TEMPLATES['simple_groups'] = """
 set ylabel "vasteaika {reps} toistolla"
 set xlabel "{xlabel}"
-plot for [I=2:{last_column}] '{filename}' index {index} using 1:I title columnhead with points ls I-1
+plot for [I=2:{last_column}] {filename} index {index} using 1:I title columnhead with points ls I-1
 """
 
 TEMPLATES['fitted_lines'] = """
 set ylabel "vasteaika {reps} toistolla"
 set xlabel "{xlabel}"
-plot for [I=2:{last_real_column}] '{filename}' index {index} using 1:I title columnhead with points ls I-1, \
-for [I={first_fitted_column}:{last_column}] '{filename}' index {index} using 1:I notitle with lines ls I-{first_fitted_column}+1
+plot for [I=2:{last_real_column}] {filename} index {index} using 1:I title columnhead with points ls I-1, \
+for [I={first_fitted_column}:{last_column}] {filename} index {index} using 1:I notitle with lines ls I-{first_fitted_column}+1
 """
 
 TEMPLATES['named_columns'] = """
 set yrange [0:*]
 set xlabel "{xlabel}"
-plot for [I=2:{last_column}] '{filename}' index {index} using I:xtic(1) title columnhead with linespoints
+plot for [I=2:{last_column}] {filename} index {index} using I:xtic(1) title columnhead with linespoints
 """
 
 TEMPLATES['histogram'] = """
@@ -158,21 +163,126 @@ set style data histograms
 set style histogram clustered
 #set style fill solid 1.0 border lt -1
 
-plot [] [0:*] for [I=2:{last_column}] '{filename}' index {index} using I:xtic(1) every ::1 title " " with histogram fillstyle solid 1.0 border lt -1
+plot [] [0:*] for [I=2:{last_column}] {filename} index {index} using I:xtic(1) every ::1 title " " with histogram fillstyle solid 1.0 border lt -1
 """
 
-measurement_id = None
-plot_directory = '/home/tituomin/gradu/paper/figures/plots'
+class Renderer(object):
+    """
+    A backend that draws the plots itself instead of writing gnuplot
+    commands. It is passed to init and output_plot in place of the
+    plot script, and gets each plot as a figure: a dict of the data
+    rows and the layout chosen by output_plot. The subclasses implement
+    init and plot.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def init(self, filename, mid, output_type):
+        """Start the plots of measurement mid, written to filename."""
+
+    @abc.abstractmethod
+    def plot(self, figure):
+        """Draw one figure."""
+
+    def sync(self):
+        """Finish the plots so far."""
+
+    def close(self):
+        """Finish all the plots."""
 
 def init(plotscript, filename, mid, output_type='pdf'):
-    global measurement_id, plot_directory
-    measurement_id = mid
+    # the plots are labeled with mid, in the directory of the session
+    current().measurement_id = mid
+    if isinstance(plotscript, Renderer):
+        plotscript.init(filename, mid, output_type)
+        return
     if output_type == 'pdf':
         plotscript.write(INIT_PLOTS_PDF.format(filename=filename))
-        plotscript.write(INIT_PLOT_LABEL_PDF.format(bid=measurement_id))
+        plotscript.write(INIT_PLOT_LABEL_PDF.format(bid=mid))
     plotscript.write(INIT_PLOTS_COMMON)
     plotscript.write(INIT_PALETTE)
 
+class GnuplotPipe(object):
+    """
+    A gnuplot process that is kept running between plots. The plot
+    commands are rendered while the next plots are computed, and the
+    data goes inline in the commands instead of into .data files.
+    Anything written is also copied to the script file, if one is set.
+    """
+    SYNC_MARKER = 'gnuplot-pipe-sync'
+
+    def __init__(self, command='gnuplot'):
+        self.command = command
+        self.process = None
+        self.script = None
+        self.name = None
+
+    def start(self):
+        self.process = Popen([self.command], stdin=PIPE, stdout=PIPE)
+
+    def save_script(self, filename):
+        # the following commands also go to filename
+        if self.script:
+            self.script.close()
+        self.script = open(filename, 'w')
+        self.name = filename
+
+    def write(self, commands):
+        if self.script:
+            self.script.write(commands)
+        self.send(commands)
+
+    def send(self, commands):
+        # only to gnuplot
+        if self.process is None:
+            self.start()
+        try:
+            self.process.stdin.write(commands)
+        except IOError:
+            # gnuplot has exited, the sync reports it
+            pass
+
+    def flush(self):
+        if self.script:
+            self.script.flush()
+        if self.process is not None:
+            try:
+                self.process.stdin.flush()
+            except IOError:
+                pass
+
+    def sync(self):
+        """
+        Close the current outputs and wait until gnuplot has rendered
+        everything written so far. Returns False if gnuplot exited,
+        the next write starts a new gnuplot.
+        """
+        if self.process is None:
+            return True
+        self.write('\nunset output\n')
+        self.send('set print "-"\nprint "{}"\nset print\n'.format(self.SYNC_MARKER))
+        self.flush()
+        for line in iter(self.process.stdout.readline, ''):
+            if line.strip() == self.SYNC_MARKER:
+                return True
+        print 'gnuplot exited with status {}'.format(self.process.wait())
+        self.process = None
+        return False
+
+    def close(self):
+        if self.script:
+            self.script.close()
+            self.script = None
+        if self.process is None:
+            return 0
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        status = self.process.wait()
+        self.process = None
+        return status
+
 GROUPTITLES={
     'direction': 'kutsusuunta',
     'from': 'kieli'
@@ -182,8 +292,12 @@ def output_plot(data_headers, data_rows, plotpath,
                 plotscript, title, specs, style, page,
                 identifier,
                 xlabel, additional_data=None, output='pdf', key_placement="inside top left", reps='XXX-fixme-XXX'):
-    global plot_directory
     template = TEMPLATES[style]
+    # the times are plotted in seconds
+    data_rows = seconds_rows(data_rows, specs['measure'])
+    session = current()
+    measurement_id = session.measurement_id
+    plot_directory = session.plot_directory
 
     rowlen = len(data_rows[0]) - 1
     size = 'normal'
@@ -201,6 +315,26 @@ def output_plot(data_headers, data_rows, plotpath,
         'special-calls-arrayregion-c-j-fit']:
         size = 'tall'
 
+    if isinstance(plotscript, Renderer):
+        plotscript.plot({
+            'headers': data_headers,
+            'rows': data_rows,
+            'title': title,
+            'style': style,
+            'identifier': identifier,
+            'measurement_id': measurement_id,
+            'xlabel': xlabel,
+            'ylabel': "vasteaika {} toistolla".format(reps),
+            'variable': specs['variable'],
+            'key_placement': key_placement,
+            'size': size,
+            'output': output,
+            # without the suffix, which depends on the renderer
+            'filename': os.path.join(plot_directory, "plot-{}-{}".format(
+                measurement_id, identifier))
+        })
+        return
+
     if output in ['latex', 'svg']:
         if output == 'latex':
             init_tmpl = INIT_PLOTS_LATEX
@@ -247,16 +381,21 @@ def output_plot(data_headers, data_rows, plotpath,
             os.path.join(plot_directory,
                          "plot-{}-{}.{}".format(measurement_id, identifier, file_suffix))))
 
+    if output == 'latex':
+        specs['tinylabels'] = True
+    if output == 'svg':
+        specs['scriptlabels'] = True
+    data = print_benchmarks(data_headers, data_rows, title, **specs)
     if plotpath:
         # external data
-        filename = os.path.join(plotpath, "plot-" + str(uuid.uuid4()) + ".data")
-        plotdata = open(filename, 'w')
-        specs['convert_to_seconds'] = False # (output == 'latex')
-        if output == 'latex':
-            specs['tinylabels'] = True
-        if output == 'svg':
-            specs['scriptlabels'] = True
-        plotdata.write(print_benchmarks(data_headers, data_rows, title, **specs))
+        datafile = os.path.join(plotpath, "plot-" + str(uuid.uuid4()) + ".data")
+        with open(datafile, 'w') as plotdata:
+            plotdata.write(data)
+        filename = "'{}'".format(datafile)
+    else:
+        # inline data, replaced by the next plot
+        filename = '$data'
+        plotscript.write("\n{} << EOD\n{}EOD\n".format(filename, data))
 
     miny = 0
     for row in data_rows:
@@ -299,9 +438,11 @@ def output_plot(data_headers, data_rows, plotpath,
         plotscript.write(template.format(
             title = title, page = identifier, filename = filename, index = 0, last_column = len(data_rows[0]),
             key_placement = key_placement, xlabel = xlabel, reps=reps, miny=miny, grouptitle=grouptitle))
+    # a pipe renders the plot now
+    plotscript.flush()
 
 
-def print_benchmarks(data_headers, data_rows, title, group=None, variable=None, measure=None, convert_to_seconds=False, tinylabels=False, scriptlabels=False):
+def print_benchmarks(data_headers, data_rows, title, group=None, variable=None, measure=None, tinylabels=False, scriptlabels=False):
     result = '#{0}\n'.format(title)
     if group and variable and measure:
         result = '#measure:{m} variable:{v} group:{g}'.format(
@@ -318,34 +459,18 @@ def print_benchmarks(data_headers, data_rows, title, group=None, variable=None,
     result += '\n'
 
     for row in data_rows:
-        results = []
-        for i, v in enumerate(row):
-            convert = convert_to_seconds and i > 0
-            results.append(format_value(v, convert_to_seconds=convert))
-        result += ' '.join(results) + '\n'
+        result += ' '.join(format_value(v) for v in row) + '\n'
     result += '\n\n'
 
     return result
 
-def format_value(value, convert_to_seconds=False):
+def format_value(value):
     if value == None:
         return "-500"
     if type(value) == str:
         return '"{0}"'.format(value)
-    if type(value) == int:
-        # 1000000000 = 1 sekuntti
-        strval = str(value)
-        if convert_to_seconds == False:
-            return strval
-        strval = strval.zfill(10)
-        strlen = len(strval)
-        return "{}.{}".format(
-            strval[0:strlen-9],
-            strval[strlen-9:])
-            
     return str(value)
-#1000000000
-#     10000
+
 def hex_color_gradient(start, end, point):
     # start, end are tuples with r,g,b values (integer)
     # point is a point between 0 (start) and 1000 (end)
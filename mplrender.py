@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import gnuplot
+
+# the line styles of gnuplot.INIT_PALETTE
+COLORS = ['#1B9E77', '#D95F02', '#7570B3', '#000000', '#E7298A',
+          '#66A61E', '#E6AB02', '#A6761D', '#666666', '#1b70b3']
+
+CM = 1 / 2.54
+
+# figure sizes in inches, like the gnuplot terminals
+SIZES = {
+    ('pdf', 'normal'): (32 * CM, 18 * CM),
+    ('pdf', 'tall'): (32 * CM, 18 * CM),
+    ('svg', 'normal'): (10, 6),
+    ('svg', 'tall'): (10, 8),
+    ('latex', 'normal'): (15 * CM, 10 * CM),
+    ('latex', 'tall'): (15 * CM, 13 * CM)
+}
+
+# the plots for LaTeX are pdf files to include
+SUFFIXES = {
+    'svg': 'svg',
+    'latex': 'pdf'
+}
+
+
+def legend_location(key_placement):
+    # a gnuplot key placement, eg. 'inside top left'
+    words = key_placement.split()
+    vertical = 'lower' if 'bottom' in words else 'upper'
+    horizontal = 'left' if 'left' in words else 'right'
+    return '{} {}'.format(vertical, horizontal)
+
+
+def column(rows, i):
+    return [float('nan') if row[i] is None else row[i] for row in rows]
+
+
+def draw(figure):
+    """
+    A matplotlib figure of a figure from gnuplot.output_plot, in the
+    style of its gnuplot template.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.ticker import EngFormatter, MultipleLocator
+
+    headers = figure['headers']
+    rows = figure['rows']
+    style = figure['style']
+    output = figure['output']
+
+    fig = Figure(figsize=SIZES[(output, figure['size'])])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.grid(True)
+    legend = figure['key_placement'] is not None
+
+    if style in ['simple_groups', 'fitted_lines']:
+        x = column(rows, 0)
+        real_columns = len(headers) - 1
+        if style == 'fitted_lines':
+            real_columns /= 2
+        for i in range(1, real_columns + 1):
+            color = COLORS[(i - 1) % len(COLORS)]
+            ax.plot(x, column(rows, i), 'o', color=color, markersize=4,
+                    label=headers[i])
+            if style == 'fitted_lines':
+                ax.plot(x, column(rows, real_columns + i), '-', color=color)
+        ax.set_ylabel(figure['ylabel'])
+        ax.set_xlabel(figure['xlabel'])
+
+    elif style == 'named_columns':
+        positions = range(len(rows))
+        for i in range(1, len(headers)):
+            ax.plot(positions, column(rows, i), 'o-', markersize=4,
+                    color=COLORS[(i - 1) % len(COLORS)], label=headers[i])
+        ax.set_xticks(positions)
+        ax.set_xticklabels([row[0] for row in rows])
+        ax.set_ylim(bottom=0)
+        ax.set_xlabel(figure['xlabel'])
+
+    elif style == 'histogram':
+        # the first row is left out, like with every ::1
+        rows = rows[1:]
+        series = len(headers) - 1
+        width = 0.8 / series
+        for i in range(1, series + 1):
+            ax.bar([p + (i - 1) * width for p in range(len(rows))],
+                   column(rows, i), width, color=COLORS[(i - 1) % len(COLORS)],
+                   edgecolor='black')
+        ax.set_xticks([p + 0.4 - width / 2 for p in range(len(rows))])
+        ax.set_xticklabels([row[0] for row in rows], rotation=90)
+        ax.set_ylim(bottom=0)
+        ax.yaxis.tick_right()
+        ax.yaxis.set_label_position('right')
+        ax.set_ylabel(figure['ylabel'])
+        legend = False
+
+    else:
+        raise ValueError('No matplotlib style for {}'.format(style))
+
+    if legend:
+        ax.legend(loc=legend_location(figure['key_placement']), numpoints=1)
+
+    if output == 'pdf':
+        ax.set_title(figure['title'])
+        ax.text(0.01, 1.06, figure['measurement_id'], transform=ax.transAxes)
+        fig.text(0.9, 0.95, figure['identifier'])
+    else:
+        ax.yaxis.set_major_formatter(EngFormatter(unit='s'))
+        if figure['variable'] == 'dynamic_size':
+            ax.set_xlim(0, 512)
+            ax.xaxis.set_major_locator(MultipleLocator(64))
+            ax.xaxis.set_major_formatter(EngFormatter(unit='B'))
+    return fig
+
+
+def render(figure):
+    # one plot to its own file, in a worker
+    filename = '{}.{}'.format(figure['filename'], SUFFIXES[figure['output']])
+    draw(figure).savefig(filename)
+    return filename
+
+
+def render_page(figure, filename):
+    # one page of a pdf to a file of its own, in a worker
+    draw(figure).savefig(filename, format='pdf')
+    return filename
+
+
+def merge_pages(pages, filename):
+    # the one-page pdf files into filename, in order
+    from PyPDF2 import PdfFileMerger
+    merger = PdfFileMerger()
+    for page in pages:
+        merger.append(page)
+    with open(filename, 'wb') as f:
+        merger.write(f)
+    merger.close()
+
+
+class MatplotlibRenderer(gnuplot.Renderer):
+    """
+    Draws the plots with matplotlib straight from the rows, in
+    parallel by the pool. The pages of a pdf are drawn to files of
+    their own and joined in order with PyPDF2; without it, they are
+    drawn in order in this process.
+    """
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.own_pool = pool is None
+        self.pages = None
+        self.results = []
+        # the pdf being drawn and its pages
+        self.filename = None
+        self.page_directory = None
+        self.page_files = []
+
+    def init(self, filename, mid, output_type):
+        self.sync()
+        if output_type != 'pdf':
+            return
+        try:
+            import PyPDF2
+        except ImportError:
+            from matplotlib.backends.backend_pdf import PdfPages
+            self.pages = PdfPages(filename)
+            return
+        self.filename = filename
+        self.page_directory = tempfile.mkdtemp(prefix='pages-')
+
+    def plot(self, figure):
+        if figure['output'] == 'pdf' and self.pages is not None:
+            self.pages.savefig(draw(figure))
+            return
+        if self.pool is None:
+            self.pool = Pool()
+        if figure['output'] == 'pdf':
+            page = os.path.join(self.page_directory, 'page-{:05d}.pdf'.format(
+                len(self.page_files)))
+            self.page_files.append(page)
+            self.results.append(self.pool.apply_async(render_page, (figure, page)))
+            return
+        self.results.append(self.pool.apply_async(render, (figure,)))
+
+    def sync(self):
+        results, self.results = self.results, []
+        for result in results:
+            result.get()
+        if self.pages is not None:
+            self.pages.close()
+            self.pages = None
+        if self.page_directory is not None:
+            try:
+                if self.page_files:
+                    merge_pages(self.page_files, self.filename)
+            finally:
+                shutil.rmtree(self.page_directory, ignore_errors=True)
+                self.page_directory = None
+                self.page_files = []
+
+    def close(self):
+        self.sync()
+        if self.own_pool and self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
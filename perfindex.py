@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+import json
+import os
+import struct
+import zipfile
+import zlib
+
+from datafiles import read_datafiles, DatafileError
+
+# Maps perf_select identifiers (revision/class[/dynamic_size]) to the
+# perf data files inside the perfdata-<id>.zip archives, so that a
+# lookup does not have to parse the benchmark files in every archive.
+INDEX_FILE = 'perfdata-index.json'
+INDEX_VERSION = 1
+
+PERF_TOOL = 'LinuxPerfRecordTool'
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 'PK\003\004'
+CHUNK_SIZE = 1024 * 1024
+
+
+def load_index(measurement_path):
+    path = os.path.join(measurement_path, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION:
+            return index
+    return {'version': INDEX_VERSION, 'archives': {}}
+
+
+def save_index(index, measurement_path):
+    path = os.path.join(measurement_path, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(path + '.tmp', path)
+
+
+def index_archive(zpath, mid, silent=False):
+    """
+    The runs of one archive:
+    [class, dynamic_size, filename, member, offset, compress_type, compress_size]
+    """
+    runs = []
+    archive = zipfile.ZipFile(zpath, 'r')
+    try:
+        csv = archive.open('{0}/benchmarks-{0}.csv'.format(mid))
+        try:
+            rows = read_datafiles([csv], silent=silent)
+        finally:
+            csv.close()
+        for row in rows:
+            if row.get('Filename') is None or row.get('class') is None:
+                continue
+            info = archive.getinfo('{}/{}'.format(mid, row['Filename']))
+            runs.append([
+                row['class'].lower(), row.get('dynamic_size'), row['Filename'],
+                info.filename, info.header_offset,
+                info.compress_type, info.compress_size])
+    finally:
+        archive.close()
+    return runs
+
+
+def update_index(index, measurements, measurement_path, silent=False):
+    """
+    Index the archives of the perf measurements that are new or have
+    changed since they were indexed, and forget the archives that no
+    longer exist. Returns True if the index changed.
+    """
+    archives = index['archives']
+    changed = False
+    for name in archives.keys():
+        if not os.path.exists(os.path.join(measurement_path, name)):
+            del archives[name]
+            changed = True
+    for group in measurements:
+        for measurement in group:
+            if measurement.get('tool') != PERF_TOOL:
+                continue
+            mid = measurement.get('id')
+            name = 'perfdata-{}.zip'.format(mid)
+            zpath = os.path.join(measurement_path, name)
+            try:
+                stat = os.stat(zpath)
+            except OSError:
+                continue
+            entry = archives.get(name)
+            if (entry and entry['mtime'] == stat.st_mtime and
+                    entry['size'] == stat.st_size):
+                continue
+            try:
+                # the archive members are named after the id on the device
+                runs = index_archive(
+                    zpath, measurement.get('device-id', mid), silent=silent)
+            except zipfile.BadZipfile:
+                print 'Bad zip file %s' % zpath
+                continue
+            except (IOError, KeyError, DatafileError) as e:
+                print 'Problem with zip file %s' % zpath
+                print e
+                continue
+            archives[name] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'revision': measurement.get('code-revision'),
+                'runs': runs
+            }
+            changed = True
+    return changed
+
+
+def lookup(index, measurement_path, revision, class_, dynamic_size=None):
+    """
+    The runs matching an identifier as dicts with the keys
+    zip_path, archive_mtime, archive_size, filename, member, offset,
+    compress_type and compress_size.
+    """
+    records = []
+    for name, entry in sorted(index['archives'].iteritems()):
+        if entry['revision'] != revision:
+            continue
+        for run in entry['runs']:
+            cls, size, filename, member, offset, compress_type, compress_size = run
+            if cls != class_.lower():
+                continue
+            if dynamic_size is not None and size != int(dynamic_size):
+                continue
+            records.append({
+                'zip_path': os.path.join(measurement_path, name),
+                'archive_mtime': entry['mtime'],
+                'archive_size': entry['size'],
+                'filename': filename,
+                'member': member,
+                'offset': offset,
+                'compress_type': compress_type,
+                'compress_size': compress_size
+            })
+    return records
+
+
+def stream_member(record):
+    """
+    Yield the uncompressed contents of an archive member, seeking
+    straight to its local header instead of reading the whole
+    archive directory.
+    """
+    with open(record['zip_path'], 'rb') as f:
+        f.seek(record['offset'])
+        header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipfile(
+                'No member at offset {} of {}'.format(
+                    record['offset'], record['zip_path']))
+        name_length, extra_length = header[-2:]
+        f.seek(name_length + extra_length, os.SEEK_CUR)
+
+        if record['compress_type'] == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif record['compress_type'] == zipfile.ZIP_STORED:
+            decompressor = None
+        else:
+            raise zipfile.BadZipfile(
+                'Unsupported compression in {}'.format(record['zip_path']))
+
+        remaining = record['compress_size']
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            yield chunk
+        if decompressor:
+            yield decompressor.flush()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict as odict
+from multiprocessing.pool import ThreadPool
+from subprocess import call
+
+from perfindex import stream_member
+
+REPORT_COMMAND = [
+    #"/home/tituomin/droid/src/out/host/linux-x86/bin/perfhost report",
+    #"/home/tituomin/install/linux-4.2.0/tools/perf/perf report",
+    "perf report",
+    "-i {input}",
+    "--header",
+    "--symfs=/home/tituomin/droid-symbols",
+    "--kallsyms=/home/tituomin/droid/linux-kernel/kallsyms"
+]
+
+REPORT_OPTIONS = [
+    "-g graph,0,caller",
+    #"--parent='dvmPlatformInvoke'",
+    #"-s parent",
+    "--stdio"
+]
+
+REPORT_WORKERS = 4
+
+# Reports are cached under the output path, named after the hash
+# of the archive member holding the perf data and the report options.
+CACHE_DIRECTORY = 'perf-reports'
+
+
+def report_command(perf_file, output_file, options=REPORT_OPTIONS):
+    command_parts = REPORT_COMMAND + options + [
+        "| c++filt",
+        ">{output}"
+    ]
+    return " ".join(command_parts).format(input=perf_file, output=output_file)
+
+
+def cache_key(record, options=REPORT_OPTIONS):
+    # the perf data is identified by its place in the indexed archive,
+    # so that a cached report is found without inflating the member
+    digest = hashlib.sha1()
+    digest.update(repr([
+        os.path.basename(record['zip_path']),
+        record['archive_mtime'], record['archive_size'], record['member'],
+        record['offset'], record['compress_type'], record['compress_size']]))
+    digest.update(" ".join(REPORT_COMMAND + options))
+    return digest.hexdigest()
+
+
+def extract(record, path):
+    perf_file = os.path.join(path, record['member'])
+    if not os.path.isdir(os.path.dirname(perf_file)):
+        os.makedirs(os.path.dirname(perf_file))
+    with open(perf_file, 'wb') as f:
+        for chunk in stream_member(record):
+            f.write(chunk)
+    return perf_file
+
+
+def run_report(job):
+    command, tmp_report, report = job
+    try:
+        # a failed perf must not leave a report behind c++filt
+        status = call(['bash', '-o', 'pipefail', '-c', command])
+    except OSError as e:
+        print e.filename, e.message, e.args
+        status = -1
+    if status != 0:
+        if os.path.exists(tmp_report):
+            os.remove(tmp_report)
+        return None
+    os.rename(tmp_report, report)
+    return report
+
+
+def render_reports(records, cache_path, options=REPORT_OPTIONS,
+                   output_command=False, workers=REPORT_WORKERS):
+    """
+    Make a perf report of every record (as returned by
+    perfindex.lookup) unless it is already in the cache, running several perf
+    processes at a time.
+
+    Returns a list of (record, report path or None if perf failed).
+    With output_command, only the command for the first record is
+    printed, and no reports are returned.
+    """
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+
+    reports = []
+    jobs = odict()
+    extract_path = tempfile.mkdtemp(prefix='perf-')
+    try:
+        for record in records:
+            report = os.path.join(
+                cache_path, cache_key(record, options) + '.txt')
+            reports.append((record, report))
+            if report in jobs or (os.path.exists(report) and not output_command):
+                continue
+
+            if output_command:
+                # the printed command must outlive this process
+                perf_file = extract(record, '/tmp')
+                print report_command(perf_file, report, options=options)
+                return []
+
+            # perf needs a seekable file
+            perf_file = extract(record, extract_path)
+            tmp_report = report + '.tmp'
+            jobs[report] = (report_command(perf_file, tmp_report, options=options),
+                            tmp_report, report)
+
+        if jobs:
+            pool = ThreadPool(min(workers, len(jobs)))
+            try:
+                pool.map(run_report, jobs.values())
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        shutil.rmtree(extract_path, ignore_errors=True)
+
+    return [(record, report if os.path.exists(report) else None)
+            for record, report in reports]
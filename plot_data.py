@@ -2,48 +2,66 @@
 # -*- coding: utf-8 -*-
 
 from collections import OrderedDict as odict
-from itertools import groupby
-from subprocess import call
+from datetime import datetime
+from fnmatch import fnmatch
+from itertools import chain, groupby, izip
+from multiprocessing import Pool, Process, Queue
+from multiprocessing.pool import ThreadPool
+from subprocess import call, Popen
 from sys import argv
-import functools
+import cPickle
+import heapq
 import pprint
 import re
 import os
 import sys
-import shutil
+import tempfile
+import time
 import uuid
 
 import glob
-import zipfile
 
-import numpy
-from numpy import array
+# numpy, jni_types, analysis, profiles and store are imported where
+# they are needed, so that the modes that don't need them start fast
 
-from jni_types import primitive_type_definitions, object_type_definitions, array_types
-from datafiles import read_datafiles, read_measurement_metadata
-import analysis
-from analysis import linear_fit, estimate_measuring_overhead
+from datafiles import read_datafiles, read_measurement_metadata, DatafileTail
+from datafiles import key_function, Spill, DatafileError
+from datafiles import SpilledDatafiles, count_rows, minimum_records
+from devicesync import sync_measurements, sync_devices, sync_files, ingest_datafiles
+from devicesync import list_devices, measurement_files, update_file, SYNC_WORKERS
 import gnuplot
+import perfindex
+import perfreports
+from session import current, AnalysisError
 import textualtable
+import units
 
-FNULL = None
+primitive_types = None
+reference_types = None
+types = None
 
-primitive_types = [
-    t['java']
-    for t in primitive_type_definitions
-]
+def load_types():
+    global primitive_types, reference_types, types
+    if types is not None:
+        return
+    from jni_types import primitive_type_definitions, object_type_definitions, array_types
 
-reference_types = [
-    t['java']
-    for t in array_types.itervalues()
-]
+    primitive_types = [
+        t['java']
+        for t in primitive_type_definitions
+    ]
 
-reference_types.extend([
-    t['java']
-    for t in object_type_definitions
-])
+    reference_types = [
+        t['java']
+        for t in array_types.itervalues()
+    ]
+
+    reference_types.extend([
+        t['java']
+        for t in object_type_definitions
+    ])
 
-types = reference_types + primitive_types
+    types = reference_types + primitive_types
 
 plot_axes = {
     'description': 'operaatioiden määrä',
@@ -54,8 +72,6 @@ plot_axes = {
 }
 pp = pprint.PrettyPrinter(depth=10, indent=4)
 
-debugdata = open('/tmp/debug.txt', 'w')
-
 def format_direction(fr, to, latex):
     if fr == 'J':
         fr = 'Java'
@@ -70,6 +86,7 @@ def format_direction(fr, to, latex):
 DIRECTIONS = [('C', 'J'), ('J', 'C'), ('J', 'J'), ('C', 'C')]
 
 def preprocess_benchmarks(benchmarks, global_values, latex=None):
+    load_types()
     # For allocating benchmarks, the repetition count for individual benchmarks
     # come from the datafile. For non-allocating, it is a global value.
     keys = set([key for b in benchmarks for key in b.keys()])
@@ -86,6 +103,11 @@ def add_derived_values(benchmark, latex=None):
         benchmark['response_time'] = benchmark.get('response_time_millis')
         benchmark['time_unit'] = 'milliseconds'
         del benchmark['response_time_millis']
+    unit = benchmark.get('time_unit')
+    if unit is not None and unit != units.TIME_UNIT:
+        benchmark['response_time'] = units.nanoseconds(
+            benchmark.get('response_time'), unit)
+        benchmark['time_unit'] = units.TIME_UNIT
     if benchmark.get('dynamic_size') == None:
         benchmark['dynamic_variation'] = 0
         benchmark['dynamic_size'] = 0
@@ -147,29 +169,48 @@ def extract_data(benchmarks,
                  group=None, variable=None, measure=None,
                  min_series_length=2, sort=None, min_series_width=None):
 
-    # info == extra metadata not to be analyzed
-    info = ['no', 'from', 'to', 'lineno', 'start', 'end']
+    # note: all the benchmarks have the same keyset
+    controlled_variables, info = key_roles(benchmarks[0], group, variable, measure)
 
-    if 'class' in benchmarks[0]:
-        info.append('class')
-    if 'description' in benchmarks[0]:
-        info.append('description')
-    if re.match('parameter_type_.+count', variable):
-        info.append('parameter_count')
-    if variable != 'id':
-        info.append('id')
+    return [x for order, x in group_series(
+                benchmarks, controlled_variables, info, group, variable, measure)
+            if len((x.values())[0]) >= min_series_length]
 
-    # note: all the benchmarks have the same keyset
-    all_keys = set(benchmarks[0].keys())
 
+def extract_data_partitioned(benchmarks, partitions,
+                             group=None, variable=None, measure=None,
+                             min_series_length=2):
+    """
+    The same series as extract_data, for benchmarks (an iterator) that
+    need not fit in memory at once: they are spilled into temporary
+    files partitioned by their controlled variables, and grouped one
+    partition at a time.
+    """
+    benchmarks = iter(benchmarks)
+    first = next(benchmarks)
+    controlled_variables, info = key_roles(first, group, variable, measure)
+
+    series = []
+    for part in spilled_partitions(
+            chain([first], benchmarks), controlled_variables, partitions):
+        if part:
+            series.extend(group_series(
+                part, controlled_variables, info, group, variable, measure))
+    series.sort(key=lambda x: x[0])
+    return [x for order, x in series
+            if len((x.values())[0]) >= min_series_length]
+
+
+def group_series(benchmarks, controlled_variables, info, group, variable, measure):
+    """
+    The series of extract_data, each with the sort key of its
+    controlled variables.
+    """
     # the actual keys of interest must have the least weight in sorting
     sort_last = [group, variable, measure] + info
-    controlled_variables = all_keys - set(sort_last)
     sorted_keys = list(controlled_variables) + sort_last
 
-    sorted_benchmarks = sorted(
-        benchmarks,
-        cmp=functools.partial(comp_function, sorted_keys))
+    sorted_benchmarks = sorted(benchmarks, key=sort_key(sorted_keys))
 
     # 1. group benchmarks into a multi-dimensional list
     #    with the following structure:
@@ -177,6 +218,8 @@ def extract_data(benchmarks,
     #      - plots (list of individual data series ie. plots)
     #        - multiple measurements ()
     benchmarks = group_by_keys(sorted_benchmarks, controlled_variables)
+    order_key = sort_key(controlled_variables)
+    orders = [order_key(x[0]) for x in benchmarks]
     for i, x in enumerate(benchmarks):
         benchmarks[i] = group_by_keys(x, [group])
         for j, y in enumerate(benchmarks[i]):
@@ -210,8 +253,57 @@ def extract_data(benchmarks,
                     for bms in benchmarks[i]),
                    key=lambda x: x[0]))
 
-    return [x for x in benchmarks
-            if len((x.values())[0]) >= min_series_length]
+    return zip(orders, benchmarks)
+
+
+def spilled_partitions(benchmarks, keys, partitions):
+    """
+    The benchmarks as partitions of the values of keys, one list at a
+    time. The benchmarks with the same values are in the same
+    partition, in their original order; the partitions not being
+    read are in temporary files.
+    """
+    key = key_function(keys, ranked=False)
+    spill = Spill(partitions)
+    try:
+        for benchmark in benchmarks:
+            spill.add(hash(tuple(key(benchmark))) % partitions, benchmark)
+        for i in range(partitions):
+            yield spill.partition(i)
+    finally:
+        spill.close()
+
+
+def partition_count(count):
+    # PLOT_MEMORY_ROWS or less per partition, if the keys are spread
+    return -(-count // PLOT_MEMORY_ROWS)
+
+
+def out_of_core(count):
+    return PLOT_MEMORY_ROWS is not None and count > PLOT_MEMORY_ROWS
+
+
+def key_roles(benchmark, group, variable, measure):
+    """
+    Returns the controlled variables and the info keys of the
+    benchmarks of a plot, which all have the keys of benchmark.
+    """
+    # info == extra metadata not to be analyzed
+    info = ['no', 'from', 'to', 'lineno', 'start', 'end']
+
+    if 'class' in benchmark:
+        info.append('class')
+    if 'description' in benchmark:
+        info.append('description')
+    if 'rounds' in benchmark:
+        info.append('rounds')
+    if re.match('parameter_type_.+count', variable):
+        info.append('parameter_count')
+    if variable != 'id':
+        info.append('id')
+
+    all_keys = set(benchmark.keys())
+    return all_keys - set([group, variable, measure] + info), info
 
 
 def group_by_keys(sorted_benchmarks, keyset):
@@ -219,41 +311,56 @@ def group_by_keys(sorted_benchmarks, keyset):
     return [
         list(y) for x, y in groupby(
             sorted_benchmarks,
-            key=lambda b: [b[k] for k in keyset])]
+            key=key_function(keyset, ranked=False))]
 
 
 def aggregate_measurements(benchmarks, measure, stat_fun=min):
     values = []
+    # the benchmarks read by store.read_minimums stand for their rounds
+    count = 0
     benchmark = None
     for benchmark in benchmarks:
         values.append(benchmark[measure])
-
+        count += benchmark.get('rounds', 1)
+
+    session = current()
+    if count != benchmark['multiplier'] and session.strict:
+        if session.debug_file:
+            with open(session.debug_file, 'w') as debugdata:
+                debugdata.write(pp.pformat(list(benchmarks)))
+        raise AnalysisError('Error: expecting {} measurements, got {}'.format(
+            benchmark['multiplier'], count))
+
+    # a copy, the benchmarks may be shared with other analyses
+    benchmark = benchmark.copy()
     benchmark[measure] = stat_fun(values)
+    return benchmark
 
-    if len(values) != benchmark['multiplier']:
-        print "Error: expecting", benchmark['multiplier'], "measurements, got", len(values)
-        debugdata.write(pp.pformat(list(benchmarks)))
-        exit(1)
 
-    return benchmark
+def sort_key(keys):
+    # categorical values sort by the rank of their dictionary code
+    return key_function(keys)
 
 
-def comp_function(keys, left, right):
-    for key in keys:
-        if key not in left and key not in right:
-            continue
-        l, r = left[key], right[key]
-        if l < r:
-            return -1
-        if l > r:
-            return 1
-    return 0
+def contains(substring):
+    """
+    A test for categorical values containing substring, to be used
+    with Record.matches. The same substring gives the same test, so
+    each distinct value is tested once.
+    """
+    try:
+        return contains.tests[substring]
+    except KeyError:
+        test = contains.tests[substring] = lambda val: substring in val
+        return test
+
+contains.tests = {}
 
 
 def without(keys, d):
     if keys == None:
         return d
-    return dict(((key, val) for key, val in d.iteritems() if key not in keys))
+    return d.without(keys)
 
 
 def plot(
@@ -264,26 +371,38 @@ def plot(
         key_placement='inside top left',
         identifier=None,
         revision=None, checksum=None, output='pdf'):
+    from analysis import linear_fit
 
     if len(benchmarks) > 0 and benchmarks[0].get('is_allocating'):
         identifier += '-alloc'
     if len(benchmarks) > 0:
         reps = benchmarks[0].get('repetitions')
 
-    filtered_benchmarks = [
-        without(keys_to_remove, x)
-        for x in benchmarks
-        if select_predicate(x)]
+    session = current()
+    if session.approximate:
+        title = APPROXIMATE_TITLE.format(title)
+
+    unchanged = session.changed is not None and not any(
+        select_predicate(x) for x in session.changed)
+    if unchanged or not plot_selected(identifier, stem=True):
+        # no new data in watch mode, or none of the plots are selected;
+        # the pages are counted so that the following plots keep their
+        # page numbers
+        session.page += count_pages(
+            benchmarks, keys_to_remove, select_predicate,
+            group, variable, measure, min_series_width)
+        return
+
+    selected_benchmarks = [x for x in benchmarks if select_predicate(x)]
 
-    variables = set([benchmark[variable] for benchmark in filtered_benchmarks])
+    variables = set([benchmark[variable] for benchmark in selected_benchmarks])
 
     if len(variables) < 2:
         print 'Skipping plot without enough data variables', title
         return
 
-    if len(filtered_benchmarks) == 0:
-        print 'Error, no benchmarks for', title
-        exit(1)
+    if len(selected_benchmarks) == 0:
+        raise AnalysisError('Error, no benchmarks for {}'.format(title))
 
     print 'Plotting', title
 
@@ -292,18 +411,19 @@ def plot(
         'variable': variable,
         'measure': measure}
 
-    data = extract_data(filtered_benchmarks, **specs)
-
-    index = -1
-
-    data_len = len([s for s in data if len(s.keys()) >= min_series_width])
-    for series in data:
-        if len(series.keys()) < min_series_width:
-            # there are not enough groups to display
-            continue
-        index += 1
+    if out_of_core(len(selected_benchmarks)):
+        # the copies without keys_to_remove go straight to the spill
+        data = extract_data_partitioned(
+            (without(keys_to_remove, x) for x in selected_benchmarks),
+            partition_count(len(selected_benchmarks)), **specs)
+    else:
+        data = extract_data(
+            [without(keys_to_remove, x) for x in selected_benchmarks], **specs)
 
-        plot.page += 1
+    plotted = plotted_series(data, min_series_width)
+    data_len = len(plotted)
+    for index, series in enumerate(plotted):
+        session.page += 1
         axes_label = plot_axes.get(variable, '<unknown variable>')
 
         headers, rows = make_table(
@@ -314,84 +434,149 @@ def plot(
         if data_len > 1:
             id_suffix = "-{}".format(index)
 
-        gnuplot.output_plot(
-            headers, rows, plotpath, gnuplot_script,
-            title, specs, style, plot.page, identifier + id_suffix, axes_label, output=output,
-            key_placement=key_placement, reps=reps
-        )
-
-        metadata_file.write("\n\n{0}\n{1}\n\n".format(title, identifier + id_suffix))
-
-        keyvalpairs = series.values()[0].values()[0]['fixed'].items() + [
-            ('variable', axes_label),
-            ('measure', measure),
-            ('grouping', group)]
-
-        for k, v in keyvalpairs:
-            if v != None:
-                metadata_file.write("{k:<25} {v}\n".format(k=k, v=v))
-
-        metadata_file.write(
-            "\n" + textualtable.make_textual_table(headers, rows))
-
-        id_headers, id_rows = make_table(
-            series, group, variable, 'class', axes_label)
-
-        def make_id(variable_value, item, variable):
-            ret = "/".join([revision, item or '-'])
-            if variable == 'dynamic_size':
-                ret += "/" + str(variable_value)
-            return ret
-
-        id_rows = [
-            [row[0]] +
-            [make_id(row[0], item, variable) for item in row[1:]]
-            for row in id_rows]
-
-        ttable = textualtable.make_textual_table(id_headers, id_rows)
-        metadata_file.write("\n" + ttable)
-
-        if variable != 'direction' and variable != 'id':
-            x, polys, residuals = linear_fit(rows)
-
-            fitted_curves = []
-            for i, xval in enumerate(x):
-                current = [xval]
-                current.extend(rows[i][1:])
-                current.extend([numpy.polyval(polys[j], xval)
-                                for j in range(0, len(rows[i]) - 1)])
-                fitted_curves.append(current)
-
-            plot.page += 1
+        if plot_selected(identifier + id_suffix):
             gnuplot.output_plot(
-                headers + headers[1:], fitted_curves, plotpath, gnuplot_script,
-                title, specs, 'fitted_lines', plot.page, identifier + id_suffix + '-fit', axes_label, output=output, reps=reps)
-
-            def simplified_function(poly):
-                return "{:.3g} * x {:+.3g}".format(poly[0], poly[1])
-            metadata_file.write(
-                "\npolynomial:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(simplified_function, polys)]))
-            metadata_file.write(
-                "\nresiduals:\n" + textualtable.make_vertical_textual_table(headers[1:], [residuals]))
-            metadata_file.write(
-                "\nslope:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(lambda p: p[0], polys)]))
-            metadata_file.write(
-                "\nintercept:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(lambda p: p[1], polys)]))
+                headers, rows, plotpath, gnuplot_script,
+                title, specs, style, session.page, identifier + id_suffix, axes_label, output=output,
+                key_placement=key_placement, reps=reps
+            )
+
+            metadata_file.write("\n\n{0}\n{1}\n\n".format(title, identifier + id_suffix))
+
+            keyvalpairs = series.values()[0].values()[0]['fixed'].items() + [
+                ('variable', axes_label),
+                ('measure', measure),
+                ('grouping', group)]
+
+            for k, v in keyvalpairs:
+                if v != None:
+                    metadata_file.write("{k:<25} {v}\n".format(k=k, v=v))
+
+            metadata_file.write("\n" + textualtable.make_textual_table(
+                headers, units.seconds_rows(rows, measure)))
+
+            id_headers, id_rows = make_table(
+                series, group, variable, 'class', axes_label)
+
+            def make_id(variable_value, item, variable):
+                ret = "/".join([revision, item or '-'])
+                if variable == 'dynamic_size':
+                    ret += "/" + str(variable_value)
+                return ret
+
+            id_rows = [
+                [row[0]] +
+                [make_id(row[0], item, variable) for item in row[1:]]
+                for row in id_rows]
+
+            ttable = textualtable.make_textual_table(id_headers, id_rows)
+            metadata_file.write("\n" + ttable)
+
+        if series_pages(variable) > 1:
+            session.page += 1
+            if plot_selected(identifier + id_suffix + '-fit'):
+                x, polys, residuals = linear_fit(rows)
+                output_fitted_plot(
+                    headers, rows, x, polys, residuals, plotpath,
+                    gnuplot_script, metadata_file, title, specs,
+                    identifier + id_suffix + '-fit', axes_label, output, reps)
     return data
 
-plot.page = 0
-
-def convert_to_seconds(value):
-    if type(value) == int:
-        strval = str(value)
-        if convert_to_seconds == False:
-            return strval
-        strval = strval.zfill(10)
-        strlen = len(strval)
-        return float("{}.{}".format(
-            strval[0:strlen-9],
-            strval[strlen-9:]))
-    return value
+APPROXIMATE_TITLE = '{} (esikatselu, likiarvot)'
+
+def output_fitted_plot(headers, rows, x, polys, residuals, plotpath,
+                       gnuplot_script, metadata_file, title, specs,
+                       identifier, axes_label, output, reps):
+    import numpy
+
+    fitted_curves = []
+    for i, xval in enumerate(x):
+        row = [xval]
+        row.extend(rows[i][1:])
+        row.extend([numpy.polyval(polys[j], xval)
+                    for j in range(0, len(rows[i]) - 1)])
+        fitted_curves.append(row)
+
+    gnuplot.output_plot(
+        headers + headers[1:], fitted_curves, plotpath, gnuplot_script,
+        title, specs, 'fitted_lines', current().page, identifier, axes_label, output=output, reps=reps)
+
+    if specs['measure'] in units.TIME_MEASURES:
+        # the fits are in nanoseconds
+        polys = [[units.seconds(c) for c in poly] for poly in polys]
+
+    def simplified_function(poly):
+        return "{:.3g} * x {:+.3g}".format(poly[0], poly[1])
+    metadata_file.write(
+        "\npolynomial:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(simplified_function, polys)]))
+    metadata_file.write(
+        "\nresiduals:\n" + textualtable.make_vertical_textual_table(headers[1:], [residuals]))
+    metadata_file.write(
+        "\nslope:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(lambda p: p[0], polys)]))
+    metadata_file.write(
+        "\nintercept:\n" + textualtable.make_vertical_textual_table(headers[1:], [map(lambda p: p[1], polys)]))
+
+# a pattern may name a numbered series or the fitted plot of a plot
+RE_PLOT_SUFFIX = re.compile('(-[0-9]+)?(-fit)?$')
+
+def plot_selected(identifier, stem=False):
+    """
+    True if the session selects no plots or the identifier matches
+    one of its patterns. With stem, also if the numbered series or
+    fitted plots of the identifier could match.
+    """
+    select = current().select
+    if select is None:
+        return True
+    for pattern in select:
+        if fnmatch(identifier, pattern):
+            return True
+        if stem and fnmatch(identifier, RE_PLOT_SUFFIX.sub('', pattern)):
+            return True
+    return False
+
+def count_pages(benchmarks, keys_to_remove, select_predicate,
+                group, variable, measure, min_series_width,
+                min_series_length=2):
+    """
+    The number of pages plot() would output, counted from the
+    distinct key values without extracting the data.
+    """
+    selected = [x for x in benchmarks if select_predicate(x)]
+    if len(set(x[variable] for x in selected)) < 2:
+        return 0
+
+    controlled_variables, info = key_roles(
+        without(keys_to_remove, selected[0]), group, variable, measure)
+    controlled_key = key_function(controlled_variables, ranked=False)
+
+    series = {}
+    for x in selected:
+        groups = series.setdefault(tuple(controlled_key(x)), {})
+        groups.setdefault(x[group], set()).add(x[variable])
+
+    # the groups in the order of extract_data
+    plotted = plotted_series(
+        [odict(sorted(groups.iteritems())) for groups in series.itervalues()],
+        min_series_width, min_series_length=min_series_length)
+    return len(plotted) * series_pages(variable)
+
+def plotted_series(data, min_series_width, min_series_length=2):
+    """
+    The series of data (mappings of the groups to their variable
+    values, in order) that plot() outputs: the ones with enough
+    groups and enough values of the variable in the first group.
+    """
+    return [series for series in data
+            if len(series) >= min_series_width and
+            len(series.values()[0]) >= min_series_length]
+
+def series_pages(variable):
+    # the plot of a series, and its fitted plot unless the variable
+    # is a category
+    if variable == 'direction' or variable == 'id':
+        return 1
+    return 2
 
 def make_table(series, group, variable, measure, axes_label):
     all_benchmark_variables_set = set()
@@ -414,8 +599,6 @@ def make_table(series, group, variable, measure, axes_label):
             val = grp.get(v, {}).get(measure, None)
             if val is None:
                 val = grp.get(v, {}).get('info', {}).get(measure, None)
-            if measure == 'response_time':
-                val = convert_to_seconds(val)
             row.append(val)
         rows.append(row)
 
@@ -429,7 +612,102 @@ def binned_value(minimum, width, value):
     return width * (int(value - minimum) / int(width)) + minimum
 
 
-def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, metadata_file, plot_type=None, latex=None, **kwargs):
+def distribution_histograms(all_values, frame_count=1):
+    """
+    The histograms (counts, bin_edges) of the frames of one
+    distribution, the frames from all of the values to the fewest.
+    """
+    import numpy
+
+    bin_width = 500
+    min_x = numpy.amin(all_values)
+    max_x = numpy.amax(all_values)
+
+    bin_no = (max_x - min_x) / bin_width
+
+    histograms = []
+    for current_frame in range(frame_count, 0, -1):
+        if current_frame == frame_count:
+            frame_ratio = 1
+        else:
+            frame_ratio = float(current_frame) / frame_count
+        values = all_values[0:int(frame_ratio * len(all_values))]
+        histograms.append(numpy.histogram(values, bins=max(bin_no, 10)))
+    return histograms
+
+# the values of every distribution in the workers of
+# plot_distributions, in memory shared with the main process
+shared_values = None
+
+def share_values(shared):
+    global shared_values
+    import numpy
+    shared_values = numpy.frombuffer(shared, dtype=numpy.int64)
+
+def shared_histograms(job):
+    start, end, frame_count = job
+    return distribution_histograms(shared_values[start:end], frame_count)
+
+def group_histograms(groups, frame_count):
+    """
+    The first benchmark and the distribution_histograms of the values
+    of every group of groups (an iterator of (first, values)) in
+    order, from a process for each core if there are several groups.
+    With PLOT_MEMORY_ROWS, about that many values are in memory at a
+    time.
+    """
+    import ctypes
+    import numpy
+    from multiprocessing.sharedctypes import RawArray
+
+    for chunk in group_chunks(groups):
+        if len(chunk) < 2:
+            for first, values in chunk:
+                yield first, distribution_histograms(numpy.array(values), frame_count)
+            continue
+
+        offsets = [0]
+        for first, values in chunk:
+            offsets.append(offsets[-1] + len(values))
+        shared = RawArray(ctypes.c_int64, offsets[-1])
+        numpy.frombuffer(shared, dtype=numpy.int64)[:] = list(
+            chain.from_iterable(values for first, values in chunk))
+        pool = Pool(initializer=share_values, initargs=(shared,))
+        try:
+            # the histograms are written as they arrive
+            for (first, values), histograms in izip(chunk, pool.imap(
+                    shared_histograms, [
+                        (start, end, frame_count)
+                        for start, end in zip(offsets, offsets[1:])], chunksize=16)):
+                yield first, histograms
+        finally:
+            pool.terminate()
+            pool.join()
+
+def group_chunks(groups):
+    # lists of the groups with about PLOT_MEMORY_ROWS values, or all
+    # of them
+    if PLOT_MEMORY_ROWS is None:
+        yield list(groups)
+        return
+    chunk = []
+    size = 0
+    for group in groups:
+        chunk.append(group)
+        size += len(group[1])
+        if size >= PLOT_MEMORY_ROWS:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+def plot_distributions(partitions, output, plotpath, gnuplotcommands, bid, metadata_file, plot_type=None, latex=None, **kwargs):
+    """
+    Unlike plot_benchmarks, takes the benchmarks as partitions (see
+    distribution_groups).
+    """
+    import numpy
 
     output_type = 'screen'
     if plot_type != 'animate':
@@ -438,38 +716,28 @@ def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, m
     gnuplot.init(gnuplotcommands, output, bid, output_type=output_type)
     measure = 'response_time'
 
-    keyset = set(all_benchmarks[0].keys()) - \
-        set([measure, 'lineno', 'start', 'end'])
-    comparison_function = functools.partial(comp_function, keyset)
-    sorted_benchmarks = sorted(all_benchmarks, cmp=comparison_function)
+    if plot_type != None:
+        keyf = lambda x: x['lineno']
+    else:
+        keyf = lambda x: x[measure]
 
-    for group in group_by_keys(sorted_benchmarks, keyset):
-        if plot_type != None:
-            keyf = lambda x: x['lineno']
-        else:
-            keyf = lambda x: x[measure]
+    # the animation pauses after the first frame, only the gradient
+    # draws them all
+    frame_count = 1
+    if plot_type == 'gradient':
+        frame_count = 256
 
-        frame_count = 1
-        if plot_type != None:
-            frame_count = 256
+    groups = distribution_groups(partitions, keyf, measure)
+    # the script is written in the order of the groups
+    for first, histograms in group_histograms(groups, frame_count):
 
         current_frame = frame_count
-        all_values = [b[measure] for b in sorted(group, key=keyf)]
-        while current_frame > 0:
+        for hgram, bin_edges in histograms:
 
             if current_frame == frame_count:
                 frame_ratio = 1
             else:
                 frame_ratio = float(current_frame) / frame_count
-            values = array(all_values[0:int(frame_ratio * len(all_values))])
-
-            bin_width = 500
-            min_x = numpy.amin(all_values)
-            max_x = numpy.amax(all_values)
-
-            bin_no = (max_x - min_x) / bin_width
-
-            hgram, bin_edges = numpy.histogram(values, bins=max(bin_no, 10))
 
             mode = bin_edges[numpy.argmax(hgram)]
             min_x = mode - 100000
@@ -477,7 +745,7 @@ def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, m
 
             if current_frame == frame_count:
                 metadata_file.write(
-                    'Direction {0}\n'.format(group[0]['direction']))
+                    'Direction {0}\n'.format(first['direction']))
                 # for val in sorted(counts.itervalues(), key=lambda x:-x['count'])[0:20]:
                 #     metadata_file.write("{:>12} {:>12} {:>12}\n".format(
                 #             val['limit'], val['percent'], val['count']))
@@ -487,9 +755,8 @@ def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, m
                 #             val['limit'], val['percent'], val['count']))
 
                 gnuplotcommands.write(
-                    gnuplot.templates['binned_init'].format(
-                        title='%s %s' % (group[0]['id'], group[
-                                         0]['direction']),
+                    gnuplot.TEMPLATES['binned_init'].format(
+                        title='%s %s' % (first['id'], first['direction']),
                         binwidth=bin_edges[1] - bin_edges[0], min_x=min_x, max_x=max_x,
                         max_y=numpy.max(hgram)))
 
@@ -503,13 +770,13 @@ def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, m
 
             if plot_type == None:
                 gnuplotcommands.write(
-                    gnuplot.templates['binned_frame'].format(
+                    gnuplot.TEMPLATES['binned_frame'].format(
                         datapoints='', color='#000033',
                         values='\n'.join(['{} {} {}'.format(val, count, val) for val, count in zip(bin_edges, hgram)])))
 
             elif plot_type == 'gradient':
                 gnuplotcommands.write(
-                    gnuplot.templates['binned_frame'].format(
+                    gnuplot.TEMPLATES['binned_frame'].format(
                         datapoints='',
                         color=gnuplot.hex_color_gradient(
                             (125, 0, 0), (255, 255, 0), 1 - frame_ratio),
@@ -519,9 +786,73 @@ def plot_distributions(all_benchmarks, output, plotpath, gnuplotcommands, bid, m
         gnuplotcommands.write("set ytics\n")
 
 
+def distribution_groups(partitions, order, measure):
+    """
+    The first benchmark and the measured values (sorted by order) of
+    every group of benchmarks with the same values in all but the
+    measure, lineno, start and end, in the order of those values.
+    The benchmarks of a group are all in the same one of partitions
+    (lists of benchmarks, read one at a time); a partition of more
+    than PLOT_MEMORY_ROWS benchmarks is partitioned further like in
+    extract_data_partitioned. The groups of all but the last
+    partition wait in temporary files.
+    """
+    keys = None
+    streams = []
+    pending = None
+    for partition in partitions:
+        if not partition:
+            continue
+        if keys is None:
+            # the same order of the keys for every partition
+            keys = list(set(partition[0].keys()) - set([measure, 'lineno', 'start', 'end']))
+        if out_of_core(len(partition)):
+            parts = spilled_partitions(
+                partition, keys, partition_count(len(partition)))
+        else:
+            parts = [partition]
+        for part in parts:
+            if pending:
+                streams.append(spilled_groups(pending))
+            # the ranks of the categorical values change as the
+            # partitions add values, so the groups are merged by the
+            # values themselves
+            group_key = sort_key(keys)
+            pending = [([group[0][key] for key in keys], len(streams), group[0],
+                        [b[measure] for b in sorted(group, key=order)])
+                       for group in group_by_keys(sorted(part, key=group_key), keys)]
+    if pending:
+        streams.append(iter(pending))
+    for key, stream, first, values in heapq.merge(*streams):
+        yield first, values
+
+
+def spilled_groups(groups):
+    """
+    The (key, stream, first, values) groups, with the values written
+    into a temporary file now and read back as they are iterated.
+    """
+    f = tempfile.TemporaryFile(prefix='groups-')
+    heads = []
+    for key, stream, first, values in groups:
+        cPickle.dump(values, f, cPickle.HIGHEST_PROTOCOL)
+        heads.append((key, stream, first))
+
+    def read():
+        f.seek(0)
+        try:
+            for key, stream, first in heads:
+                yield key, stream, first, cPickle.load(f)
+        finally:
+            f.close()
+    return read()
+
+
 def plot_benchmarks(
         all_benchmarks, output, plotpath, gnuplotcommands, bid, metadata_file,
         plot_type=None, revision=None, checksum=None, latex=None):
+    from analysis import estimate_measuring_overhead
+    load_types()
 
     output_type = 'pdf'
     if latex == 'plotlatex':
@@ -559,7 +890,7 @@ def plot_benchmarks(
                 identifier='{}-{}'.format(loop_type.lower(), from_lang.lower()),
                 keys_to_remove=[],
                 select_predicate=(
-                        lambda x: x['from'] == from_lang and loop_type in x['id']),
+                        lambda x: x['from'] == from_lang and x.matches('id', contains(loop_type))),
                 group='from',
                 measure='response_time',
                 variable='description',
@@ -570,8 +901,8 @@ def plot_benchmarks(
             if overhead_data == None:
                 continue
             if len(overhead_data) > 1:
-                print 'Error, more loop types than expected.', len(overhead_data)
-                exit(1)
+                raise AnalysisError('Error, more loop types than expected. {}'.format(
+                    len(overhead_data)))
 
             series = overhead_data[0]
             headers, rows = make_table(series,
@@ -581,7 +912,7 @@ def plot_benchmarks(
                                        'workload')
             est = estimate_measuring_overhead(rows[1:])
             overhead_estimates[from_lang][loop_type] = est[0]
-            metadata_file.write('Overhead ' + from_lang + ' ' + str(est[0]))
+            metadata_file.write('Overhead ' + from_lang + ' ' + str(units.seconds(est[0])))
 
     for i, ptype in enumerate(types):
         plot(
@@ -669,22 +1000,25 @@ def plot_benchmarks(
         revision=revision, checksum=checksum, output=output_type)
     # had: sort 'response_time', min_series_width: 2 , unused?
 
-    def utf(b):
-        return 'UTF' in b['id'] or 'Utf' in b['id']
+    # the filters test the benchmark ids, once per distinct id
+    def utf(bid):
+        return 'UTF' in bid or 'Utf' in bid
 
     filters = {
         'utf': utf,
-        'arrayregion': lambda x: 'ArrayRegion' in x['id'],
-        'bytebufferview': lambda x: 'ByteBufferView' in x['id'],
-        'unicode': lambda b: not utf(b) and 'String' in b['id'],
-        'arrayelements': (lambda x:
-                          'ArrayElements' in x['id'] or
-                          'ArrayLength' in x['id'] or
-                          'ReadPrimitive' in x['id']),
+        'arrayregion': lambda bid: 'ArrayRegion' in bid,
+        'bytebufferview': lambda bid: 'ByteBufferView' in bid,
+        'unicode': lambda bid: not utf(bid) and 'String' in bid,
+        'arrayelements': (lambda bid:
+                          'ArrayElements' in bid or
+                          'ArrayLength' in bid or
+                          'ReadPrimitive' in bid),
     }
-    def uncategorized(x):
+    def uncategorized(bid):
+        if 'Overhead' in bid:
+            return False
         for f in filters.values():
-            if f(x):
+            if f(bid):
                 return False
         return True
 
@@ -692,11 +1026,11 @@ def plot_benchmarks(
     for key, f in filters.iteritems():
         benchmarks[key] = [
             bm for bm in all_benchmarks
-            if bm['no'] == -1 and f(bm)]
+            if bm['no'] == -1 and bm.matches('id', f)]
 
     benchmarks['uncategorized'] = [
         bm for bm in all_benchmarks
-        if bm['no'] == -1 and 'Overhead' not in bm['id'] and uncategorized(bm)]
+        if bm['no'] == -1 and bm.matches('id', uncategorized)]
 
     custom_benchmarks = benchmarks['uncategorized']
 
@@ -776,7 +1110,7 @@ def plot_benchmarks(
             select_predicate=(
                 lambda x: (x['direction'] == direction and
                            x['dynamic_variation'] == 1 and
-                           'Bulk' not in x['id'])),
+                           not x.matches('id', contains('Bulk')))),
             group='id',
             measure='response_time',
             variable='dynamic_size',
@@ -790,7 +1124,7 @@ def plot_benchmarks(
             select_predicate=(
                 lambda x: (x['direction'] == direction and
                            x['dynamic_variation'] == 1 and
-                           'Bulk' in x['id'])),
+                           x.matches('id', contains('Bulk')))),
             group='id',
             measure='response_time',
             variable='dynamic_size',
@@ -804,7 +1138,7 @@ def plot_benchmarks(
         select_predicate=(
             lambda x: (
                 x['dynamic_variation'] == 0 and
-                'Field' in x['id'])),
+                x.matches('id', contains('Field')))),
         group='direction',
         measure='response_time',
         variable='id',
@@ -817,39 +1151,9 @@ PLOTPATH = '/tmp'
 TOOL_NAMESPACE = 'fi.helsinki.cs.tituomin.nativebenchmark.measuringtool'
 
 
-def sync_measurements(dev_path, host_path, filename, update=True):
-    old_path = host_path + '/' + filename
-    tmp_path = '/tmp/' + filename
-    if not update and os.path.exists(old_path):
-        print 'No sync necessary'
-        return
-
-    kwargs = {}
-    if FNULL is not None:
-        kwargs['stdout'] = FNULL
-        kwargs['stderr'] = FNULL
-
-    try:
-        success = call(['adb', 'pull',
-                        dev_path + '/' + filename,
-                        tmp_path], **kwargs)
-    except OSError:
-        success = -1
-    if success == 0:
-        if os.path.exists(old_path):
-            size_new = os.path.getsize(tmp_path)
-            size_old = os.path.getsize(old_path)
-            if size_new < size_old:
-                print "Warning: new file contains less data than the old. Aborting."
-                exit(2)
-        shutil.move(tmp_path, old_path)
-
-    else:
-        print "Could not get new measurements, continuing with old."
-
-def render_perf_reports_for_measurement(identifier, measurements, measurement_path, output_path, output_command=False):
+def parse_perf_identifier(identifier):
     path = identifier.split("/")
-    if len(path) < 2:
+    if len(path) < 2 or len(path) > 3:
         print 'Invalid identifier {}'.format(identifier)
         exit(1)
     if len(path) == 3:
@@ -857,186 +1161,269 @@ def render_perf_reports_for_measurement(identifier, measurements, measurement_pa
     elif len(path) == 2:
         revision, class_ = path
         dynamic_size = None
+    return revision, class_, dynamic_size
 
-    def match_measurement(measurement):
-        m = measurement[0]
-        return (m.get('code-revision') == revision and
-                m.get('tool') == 'LinuxPerfRecordTool')
+def perf_reports_for_identifier(identifier, measurements, measurement_path, output_path, output_command=False):
+    revision, class_, dynamic_size = parse_perf_identifier(identifier)
 
-    def match_measurement_run(m):
-        if m.get('class').lower() != class_.lower():
-            return False
-        if dynamic_size and m.get('dynamic_size') != int(dynamic_size):
-            return False
-        if 'Filename' not in m or m['Filename'] is None:
-            return False
-        return True
+    index = perfindex.load_index(measurement_path)
+    if perfindex.update_index(index, measurements, measurement_path,
+                              silent=output_command):
+        perfindex.save_index(index, measurement_path)
 
-    datafiles = []
-    for measurement in filter(match_measurement, measurements): #TODO: multiple?
-        mid = measurement[0].get('id')
-        zpath = os.path.join(measurement_path, 'perfdata-{}.zip'.format(mid))
-        try:
-            measurement_zipfile = zipfile.ZipFile(zpath, 'r')
-            datafiles.append({
-                'zip': measurement_zipfile,
-                'zip_path': zpath,
-                'mid': mid,
-                'csv': measurement_zipfile.open('{0}/benchmarks-{0}.csv'.format(mid))
-            })
-        except zipfile.BadZipfile:
-            print 'Bad zip file %s' % zpath
-        except IOError as e:
-            print 'Problem with zip file %s' % zpath
-            print e
+    matching_benchmarks = perfindex.lookup(
+        index, measurement_path, revision, class_, dynamic_size)
 
-    benchmarks = []
-    for df in datafiles:
-        benchmarks.append({
-            'zip': df['zip'],
-            'mid': df['mid'],
-            'metadata': read_datafiles([df['csv']], silent=output_command)
-        })
-
-    matching_benchmarks = []
-    for bm in benchmarks:
-        for row in bm['metadata']:
-            if match_measurement_run(row):
-                matching_benchmarks.append({
-                    'zip': bm['zip'],
-                    'mid': bm['mid'],
-                    'filename': row['Filename']
-                })
-
-    for record in matching_benchmarks:
-        perf_file = record['zip'].extract('{}/{}'.format(record['mid'], record['filename']), '/tmp')
-        try:
-            command_parts = [
-                #"/home/tituomin/droid/src/out/host/linux-x86/bin/perfhost report",
-                #"/home/tituomin/install/linux-4.2.0/tools/perf/perf report",
-                "perf report",
-                "-i {}",
-                "--header",
-                "--symfs=/home/tituomin/droid-symbols",
-                "--kallsyms=/home/tituomin/droid/linux-kernel/kallsyms"
-            ]
-            #if not output_command:
-            command_parts.extend([
-                "-g graph,0,caller",
-                #"--parent='dvmPlatformInvoke'",
-                #"-s parent",
-                "--stdio",
-                "| c++filt",
-                ">/tmp/out.txt"
-            ])
-            command = " ".join(command_parts).format(perf_file)
-            if output_command:
-                print command
-                exit(0)
-            else:
-                call([command], shell=True)
-        except OSError as e:
-            print e.filename, e.message, e.args
-
-    for f in datafiles:
-        f['zip'].close()
-    print "Profile for identifier", identifier
-    with open('/tmp/out.txt', 'r') as f:
-        print f.read()
+    return perfreports.render_reports(
+        matching_benchmarks,
+        os.path.join(output_path, perfreports.CACHE_DIRECTORY),
+        output_command=output_command)
+
+def render_perf_reports_for_measurement(identifier, measurements, measurement_path, output_path, output_command=False):
+    reports = perf_reports_for_identifier(
+        identifier, measurements, measurement_path, output_path,
+        output_command=output_command)
+
+    for record, report in reports:
+        print "Profile for identifier", identifier, record['filename']
+        if report is None:
+            print "perf report failed"
+            continue
+        with open(report, 'r') as f:
+            print f.read()
     exit(0)
 
-if __name__ == '__main__':
-    if len(argv) < 4 or len(argv) > 6:
-        print argv[0]
-        print "\n    Usage: %s input_path output_path limit [pdfviewer] [separate]\n".format(argv[0])
+def folded_profile_for_identifier(identifier, measurements, measurement_path, output_path):
+    import profiles
+    # the call graphs of all the runs matching the identifier, merged
+    reports = perf_reports_for_identifier(
+        identifier, measurements, measurement_path, output_path)
+    profiles_ = [profiles.read_folded_report(report)
+                 for record, report in reports if report is not None]
+    if len(profiles_) == 0:
+        print 'No perf reports for identifier {}'.format(identifier)
         exit(1)
+    print 'Merged {} perf reports for {}'.format(len(profiles_), identifier)
+    return profiles.merge_folded(profiles_)
+
+def render_flame_graph_for_measurement(identifier, measurements, measurement_path, output_path):
+    import profiles
+    stacks, weights = folded_profile_for_identifier(
+        identifier, measurements, measurement_path, output_path)
+
+    basename = os.path.join(
+        output_path, 'flamegraph-{}'.format(identifier.replace('/', '-')))
+    with open(basename + '.folded', 'w') as f:
+        profiles.write_folded(f, stacks, weights)
+    with open(basename + '.svg', 'w') as f:
+        profiles.write_flame_graph(f, stacks, weights, title=identifier)
+    print basename + '.folded'
+    print basename + '.svg'
+    exit(0)
 
-    FNULL = open(os.devnull, 'w')
-
-    method = argv[0]
-    measurement_path = os.path.normpath(argv[1])
-    output_path = argv[2]
-
-    if 'plotlatex' in method:
-        latex = 'plotlatex'
-        method = 'curves'
-    elif 'plotsvg' in method:
-        latex = 'plotsvg'
-        method = 'curves'
-    else:
-        latex = None
-
-    output_command = False
-    if len(argv) > 5:
-        if argv[5] == 'show-command':
-            output_command = True
-
-    limit = argv[3]
-    if len(argv) > 4:
-        pdfviewer = argv[4]
-    else:
-        pdfviewer = None
+def render_profile_diff_for_measurements(identifiers, measurements, measurement_path, output_path):
+    import profiles
+    before, after = [
+        folded_profile_for_identifier(identifier, measurements, measurement_path, output_path)
+        for identifier in identifiers]
+
+    basename = os.path.join(
+        output_path, 'profile-diff-{}-{}'.format(
+            *[identifier.replace('/', '-') for identifier in identifiers]))
+    with open(basename + '.txt', 'w') as f:
+        profiles.write_profile_diff(f, before, after, labels=identifiers)
+    with open(basename + '.svg', 'w') as f:
+        profiles.write_diff_flame_graph(
+            f, before, after, title='{} -> {}'.format(*identifiers))
+    with open(basename + '.txt', 'r') as f:
+        print f.read()
+    print basename + '.svg'
+    exit(0)
 
-    if len(argv) == 6:
-        group = (not argv[5] == "separate")
+def sync_measurement_metadata(measurement_path):
+    # DEVICE_SERIALS: comma-separated serials, or 'all' for every
+    # attached device. Without it the only attached device is used.
+    serials = os.getenv('DEVICE_SERIALS')
+    if serials == 'all':
+        sync_devices(DEVICE_PATH, measurement_path, MEASUREMENT_FILE,
+                     list_devices())
+    elif serials:
+        sync_devices(DEVICE_PATH, measurement_path, MEASUREMENT_FILE,
+                     serials.split(','))
     else:
-        group = True
-
-    if output_command:
-        system_stdout = sys.stdout
-        system_stderr = sys.stderr
-        sys.stdout = FNULL
-        sys.stderr = FNULL
-
-    sync_measurements(DEVICE_PATH, measurement_path, MEASUREMENT_FILE)
+        sync_measurements(DEVICE_PATH, measurement_path, MEASUREMENT_FILE)
 
+def load_measurement_metadata(measurement_path, group):
     f = open(os.path.join(measurement_path, MEASUREMENT_FILE))
-
     try:
-        measurements = read_measurement_metadata(f, group)
+        return read_measurement_metadata(f, group)
     finally:
         f.close()
 
-    limited_measurements = filter(lambda x: int(x[0].get('repetitions', 0)) >= int(limit),
-                                  measurements.values())
-
-    # ID = revision/checksum/class[/dynamic_size]
-    if 'perf_select' in method:
-        identifier = argv[4]
-        if output_command:
-            sys.stdout = system_stdout
-            sys.stderr = system_stderr
-            FNULL.close()
-        render_perf_reports_for_measurement(identifier, limited_measurements, measurement_path, output_path, output_command=output_command)
-        exit(0)
-
-    csv_files = set()
-    for f in glob.iglob(measurement_path + '/benchmarks-*.csv'):
-        try:
-            csv_files.add(f.split('.csv')[0].split('benchmarks-')[1])
-        except IndexError:
-            pass
-
-    if len(limited_measurements) > 20:
-        i = len(limited_measurements) - 20 + 1
-        splice = limited_measurements[-20:]
-    else:
-        i = 1
-        splice = limited_measurements
+WATCH_INTERVAL = int(os.getenv('WATCH_INTERVAL', 30))
+
+# PLOT_PIPE: render with a gnuplot process that is kept running, as
+# the plots are computed, instead of running gnuplot on the script
+PLOT_PIPE = bool(os.getenv('PLOT_PIPE'))
+
+# PLOT_MEMORY_ROWS: have at most about this many rows in memory at a
+# time; larger measurement groups are parsed into temporary files and
+# read back one partition at a time, and so are larger plots
+PLOT_MEMORY_ROWS = int(os.getenv('PLOT_MEMORY_ROWS', 0)) or None
+
+# PLOT_PREVIEW: plot the curves from a sample of this many rows of
+# every benchmark configuration first, and with PLOT_REFINE, replace
+# them with the exact plots when they are done
+PLOT_PREVIEW = int(os.getenv('PLOT_PREVIEW', 0)) or None
+PLOT_REFINE = bool(os.getenv('PLOT_REFINE'))
+
+# PLOT_BACKEND=matplotlib: draw the curves with mplrender instead of
+# gnuplot
+PLOT_BACKEND = os.getenv('PLOT_BACKEND', 'gnuplot')
+
+def open_renderer(pool=None):
+    import mplrender
+    return mplrender.MatplotlibRenderer(pool=pool)
+
+def watch_measurement_group(
+        benchmark_group, method, measurement_path, output_path,
+        benchmark_group_id, group=True, latex=None, from_device=False):
+    """
+    Plot a group that is still being measured, then keep following
+    its datafiles (and the new measurements of the group) every
+    WATCH_INTERVAL seconds. Only the new rows are read, and only the
+    plots they belong to are rendered again, one file per plot in
+    output_path (svg unless plotting for LaTeX).
+    """
+    if 'curves' not in method:
+        raise AnalysisError('Watch mode only supports curves.')
+
+    latex = latex or 'plotsvg'
+    # the caller's session is left as it was
+    session = current().derive(plot_directory=output_path, strict=False)
+
+    first_id = benchmark_group[0]['id']
+    plot_prefix = 'plot-{0}'.format(benchmark_group_id)
+    tails = odict()
+    raw_benchmarks = []
+    benchmarks = []
+    global_values = None
+    empty_keys = None
+    metadata_file = open(os.path.join(
+        output_path, plot_prefix + '-metadata.txt'), 'w')
+    # the same gnuplot or renderer draws every round
+    pipe = gnuplot.GnuplotPipe() if PLOT_PIPE else None
+    renderer = open_renderer() if PLOT_BACKEND == 'matplotlib' else None
 
-    print "\nAvailable compatible measurements. Choose one"
-    for m in splice:
-        b = m[0]
-        warning = ""
-        if int(b.get('rounds')) == 0:
-            warning = " <---- WARNING INCOMPLETE MEASUREMENT"
-        print """
+    try:
+        with session:
+            while True:
+                if from_device:
+                    sync_measurement_metadata(measurement_path)
+                    for measurement in benchmark_group:
+                        transfer = measurement_files(measurement)[0]
+                        if update_file(DEVICE_PATH, measurement_path, transfer) == 'shrunk':
+                            print 'Warning: {} shrunk, not updated.'.format(transfer.local)
+                # new measurements of the same group
+                for m in load_measurement_metadata(measurement_path, group).values():
+                    if first_id in [measurement['id'] for measurement in m]:
+                        benchmark_group = m
+
+                for measurement in benchmark_group:
+                    datafile = measurement_files(measurement)[0].local
+                    if datafile not in tails:
+                        tails[datafile] = DatafileTail(
+                            os.path.join(measurement_path, datafile))
+
+                new_benchmarks = []
+                for tail in tails.values():
+                    new_benchmarks.extend(tail.read())
+                raw_benchmarks.extend(new_benchmarks)
+
+                first_measurement = benchmark_group[0]
+                current_values = measurement_values(benchmark_group)
+                labels = set(key for tail in tails.values() for key in (tail.labels or []))
+                current_empty_keys = labels - set(
+                    key for tail in tails.values() for key in tail.keys_with_values)
+
+                def prepare(rows):
+                    # like merge_datafiles, the keys without any values are dropped
+                    return preprocess_benchmarks(
+                        [without(current_empty_keys, b) for b in rows],
+                        current_values, latex=latex)
+
+                if current_values != global_values or current_empty_keys != empty_keys:
+                    # everything depends on these
+                    global_values = current_values
+                    empty_keys = current_empty_keys
+                    benchmarks = prepare(raw_benchmarks)
+                    session.changed = None
+                elif new_benchmarks:
+                    session.changed = prepare(new_benchmarks)
+                    benchmarks.extend(session.changed)
+                else:
+                    time.sleep(WATCH_INTERVAL)
+                    continue
+
+                if benchmarks:
+                    print 'Plotting {} new of {} benchmarks'.format(
+                        len(new_benchmarks), len(benchmarks))
+                    script_filename = os.path.join(output_path, plot_prefix + '.gp')
+                    if renderer:
+                        plotfile = renderer
+                    elif pipe:
+                        pipe.save_script(script_filename)
+                        plotfile = pipe
+                    else:
+                        plotfile = open(script_filename, 'w')
+                    metadata_file.write("-*- mode: perf-report; -*-\n\n")
+                    metadata_file.write("id: {0}\n".format(benchmark_group_id))
+                    metadata_file.write("measurements: {0}\n".format(
+                        " ".join(m['id'] for m in benchmark_group)))
+                    metadata_file.write("updated: {0}\n".format(datetime.now()))
+                    session.page = 0
+                    plot_benchmarks(
+                        benchmarks,
+                        os.path.join(output_path, plot_prefix),
+                        None if pipe or renderer else PLOTPATH,
+                        plotfile,
+                        benchmark_group_id,
+                        metadata_file,
+                        revision=first_measurement['code-revision'],
+                        checksum=first_measurement['code-checksum'],
+                        latex=latex)
+                    metadata_file.flush()
+                    if renderer:
+                        renderer.sync()
+                    elif pipe:
+                        pipe.sync()
+                    else:
+                        plotfile.close()
+                        call(["gnuplot", plotfile.name])
+                print 'Watching, press Ctrl-C to stop.'
+                time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        metadata_file.close()
+        if pipe:
+            pipe.close()
+        if renderer:
+            renderer.close()
+
+def print_measurement_group(idx, m, csv_files):
+    b = m[0]
+    warning = ""
+    if int(b.get('rounds')) == 0:
+        warning = " <---- WARNING INCOMPLETE MEASUREMENT"
+    print """
     [{idx}]:     total measurements: {num}
                            local: {local}
                      repetitions: {reps}
                      description: {desc}
                           rounds: {rounds}{warning}
                               id: {mid}
+                          device: {device}
                         checksum: {ck}
                         revision: {rev}
                             tool: {tool}
@@ -1046,24 +1433,36 @@ if __name__ == '__main__':
                            dates: {first} -
                                   {last}
     """.format(
-            local=b.get('id') in csv_files,
-            num=len(m),
-            mid=b.get('id'),
-            idx=i,
-            warning=warning,
-            last=m[-1]['end'],
-            rounds=reduce(lambda x, y: y + x, [int(b['rounds']) for b in m]),
-            reps=b.get('repetitions'),
-            ck=b.get('code-checksum'),
-            rev=b.get('code-revision'),
-            tool=b.get('tool'),
-            freq=b.get('cpu-freq'),
-            bset=b.get('benchmark-set'),
-            desc=b.get('description'),
-            sfilter=b.get('substring-filter'),
-            first=b.get('start')
-        )
+        local=b.get('id') in csv_files,
+        num=len(m),
+        mid=b.get('id'),
+        device=b.get('device', '-'),
+        idx=idx,
+        warning=warning,
+        last=m[-1]['end'],
+        rounds=reduce(lambda x, y: y + x, [int(b['rounds']) for b in m]),
+        reps=b.get('repetitions'),
+        ck=b.get('code-checksum'),
+        rev=b.get('code-revision'),
+        tool=b.get('tool'),
+        freq=b.get('cpu-freq'),
+        bset=b.get('benchmark-set'),
+        desc=b.get('description'),
+        sfilter=b.get('substring-filter'),
+        first=b.get('start')
+    )
 
+def choose_measurement_group(limited_measurements, csv_files):
+    if len(limited_measurements) > 20:
+        i = len(limited_measurements) - 20 + 1
+        splice = limited_measurements[-20:]
+    else:
+        i = 1
+        splice = limited_measurements
+
+    print "\nAvailable compatible measurements. Choose one"
+    for m in splice:
+        print_measurement_group(i, m, csv_files)
         i += 1
 
     try:
@@ -1072,110 +1471,506 @@ if __name__ == '__main__':
         print 'Exiting.'
         exit(1)
 
-    benchmark_group = limited_measurements[int(response) - 1]
+    return limited_measurements[int(response) - 1]
 
-    filenames = []
-    ids = []
-    multiplier = 0
-    for measurement in benchmark_group:
-        if 'LinuxPerfRecordTool' in measurement['tool']:
-            basename = "perfdata-{n}.zip"
-        else:
-            basename = "benchmarks-{n}.csv"
-        filenames.append(
-            basename.format(n=measurement['id']))
-        if 'logfile' in measurement:
-            filenames.append(measurement['logfile'])
-        ids.append(measurement['id'])
-        multiplier += int(measurement['rounds'])
+# measurements.txt has had both ISO dates and Java's Date.toString()
+DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%a %b %d %H:%M:%S %Y',
+    '%Y-%m-%d'
+]
 
-    files = []
-    for filename in filenames:
-        sync_measurements(DEVICE_PATH, measurement_path,
-                          filename, update=False)
-        if filename not in [m.get('logfile') for m in benchmark_group]:
-            files.append(open(os.path.join(measurement_path, filename)))
+def parse_date(string):
+    if not string:
+        return None
+    parts = string.split()
+    if len(parts) == 6:
+        # drop the time zone of Date.toString(), strptime can't parse it
+        del parts[4]
+    string = ' '.join(parts).split('.')[0]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(string, date_format)
+        except ValueError:
+            pass
+    return None
 
-    first_measurement = benchmark_group[0]
+SELECT_KEYS = {
+    'id': 'id',
+    'revision': 'code-revision',
+    'tool': 'tool',
+    'device': 'device'
+}
 
-    global_values = {
+def parse_selection(selection):
+    """
+    PLOT_SELECT is 'all' or comma-separated key=value criteria with
+    the keys id, revision, tool, device and since (a date). Values of
+    the same key are alternatives, different keys must all match.
+    """
+    criteria = {}
+    for term in selection.split(','):
+        term = term.strip()
+        if term == 'all' or not term:
+            continue
+        key, _, val = term.partition('=')
+        if key not in SELECT_KEYS and key != 'since':
+            raise ValueError('Unknown selection {}'.format(term))
+        if key == 'since':
+            val = parse_date(val)
+            if val is None:
+                raise ValueError('Invalid date in {}'.format(term))
+        criteria.setdefault(key, []).append(val)
+    return criteria
+
+def group_matches(benchmark_group, criteria):
+    for key, values in criteria.iteritems():
+        if key == 'since':
+            # measured at least partly since the date
+            end = parse_date(benchmark_group[-1].get('end') or
+                             benchmark_group[0].get('start'))
+            if end is None or end < min(values):
+                return False
+        elif key == 'id':
+            # any measurement of a combined group
+            if not any(m.get('id') in values for m in benchmark_group):
+                return False
+        elif key == 'tool':
+            tool = benchmark_group[0].get('tool') or ''
+            if not any(val in tool for val in values):
+                return False
+        elif benchmark_group[0].get(SELECT_KEYS[key]) not in values:
+            return False
+    return True
+
+def measurement_values(benchmark_group):
+    # the values of every benchmark of the group
+    first_measurement = benchmark_group[0]
+    return {
         'repetitions': first_measurement['repetitions'],
         'is_allocating': first_measurement['benchmark-set'] == 'ALLOC',
-        'multiplier': multiplier
+        'multiplier': sum(int(m['rounds']) for m in benchmark_group)
     }
 
-    perf = False
-    if 'LinuxPerfRecordTool' in first_measurement['tool']:
-        print 'Perf data downloaded.'
-        perf = True
-    if not perf:
-        try:
-            benchmarks = read_datafiles(files)
-
-        finally:
-            for f in files:
-                f.close()
-
-        benchmark_group_id = os.getenv('PLOT_ID', str(uuid.uuid4()))
-        plot_prefix = 'plot-{0}'.format(benchmark_group_id)
-
-        if latex is not None:
-            output_filename = os.path.join(output_path, plot_prefix)
-        else:
-            output_filename = os.path.join(output_path, plot_prefix + '.pdf')
-        plot_filename = plot_prefix + '.gp'
-
-        plotfile = open(os.path.join(output_path, plot_filename), 'w')
-        metadata_file = open(os.path.join(
-            output_path, plot_prefix + '-metadata.txt'), 'w')
-
-        measurement_ids = " ".join(ids)
-        metadata_file.write("-*- mode: perf-report; -*-\n\n")
-        metadata_file.write("id: {0}\n".format(benchmark_group_id))
-        metadata_file.write("measurements: {0}\n".format(measurement_ids))
+def select_measurement_groups(limited_measurements, criteria):
+    return [m for m in limited_measurements if group_matches(m, criteria)]
+
+def process_measurement_group(
+        benchmark_group, method, measurement_path, output_path,
+        benchmark_group_id, latex=None, pdfviewer=None,
+        pool=None, parse_pool=None, pipe=None, sample=None):
+    """
+    Sync, read and plot one group of compatible measurements.
+    Returns the final plot file, or None if nothing was plotted.
+    The plots are rendered with pipe (a gnuplot.GnuplotPipe) if
+    given, or if PLOT_PIPE is set. With PLOT_BACKEND=matplotlib, the
+    curves are drawn by the workers of parse_pool instead.
+    With sample, the curves are a preview from that many rows of
+    every configuration, refined afterwards in a background process
+    if PLOT_REFINE is set.
+    """
+    filenames = []
+    datafiles = []
+    ids = []
+    for measurement in benchmark_group:
+        transfers = measurement_files(measurement)
+        filenames.extend(transfers)
+        datafiles.append(transfers[0].local)
+        ids.append(measurement['id'])
 
-        benchmarks = preprocess_benchmarks(benchmarks, global_values, latex=latex)
+    first_measurement = benchmark_group[0]
+    global_values = measurement_values(benchmark_group)
 
-        animate = False
-        if pdfviewer == 'anim':
-            plot_type = 'animate'
-            pdfviewer = None
-        elif pdfviewer == 'gradient':
-            plot_type = 'gradient'
-            pdfviewer = None
-        else:
-            plot_type = None
+    if 'LinuxPerfRecordTool' in first_measurement['tool']:
+        sync_files(DEVICE_PATH, measurement_path, filenames, pool=pool)
+        print 'Perf data downloaded.'
+        return None
 
     if 'curves' in method:
         function = plot_benchmarks
     elif 'distributions' in method:
+        # a sample would change the distributions
         function = plot_distributions
-    if perf or not function:
-        exit(0)
+        sample = None
+    else:
+        return None
+
+    spilled = None
+    if os.getenv('PLOT_STORE'):
+        # PLOT_STORE: read the benchmarks from the local database,
+        # storing the new and changed datafiles into it first. The
+        # curves only need the minimum of every configuration, which
+        # the database takes; the selections of the plots are Python
+        # predicates and still run on those.
+        import store
+        sync_files(DEVICE_PATH, measurement_path, filenames, pool=pool)
+        db = store.connect(measurement_path)
+        try:
+            store.ingest(db, measurement_path, [benchmark_group])
+            if function == plot_benchmarks:
+                # the minimums are exact and few, no need for a preview
+                sample = None
+                benchmarks = store.read_minimums(db, ids)
+            else:
+                benchmarks = store.read_benchmarks(db, ids)
+        finally:
+            db.close()
+    else:
+        paths = [os.path.join(measurement_path, datafile) for datafile in datafiles]
+        if PLOT_MEMORY_ROWS is not None and not sample:
+            # the rows are counted first, so that a group with more
+            # than PLOT_MEMORY_ROWS is never all in memory
+            sync_files(DEVICE_PATH, measurement_path, filenames, pool=pool)
+            count = count_rows(paths)
+            if out_of_core(count):
+                spilled = SpilledDatafiles(paths, partition_count(count))
+        if spilled is None:
+            benchmarks = ingest_datafiles(
+                DEVICE_PATH, measurement_path, filenames, datafiles,
+                pool=pool, parse_pool=parse_pool, sample=sample)
+        elif function == plot_benchmarks:
+            # the curves only need the minimum of every configuration
+            try:
+                benchmarks = [minimum for partition in spilled.partitions()
+                              for minimum in minimum_records(partition)]
+            finally:
+                spilled.close()
+            spilled = None
+
+    plot_prefix = 'plot-{0}'.format(benchmark_group_id)
+
+    if latex is not None:
+        output_filename = os.path.join(output_path, plot_prefix)
+    else:
+        output_filename = os.path.join(output_path, plot_prefix + '.pdf')
+    plot_filename = plot_prefix + '.gp'
 
-    function(
-        benchmarks,
-        output_filename,
-        PLOTPATH,
-        plotfile,
-        benchmark_group_id,
-        metadata_file,
-        plot_type=plot_type,
-        revision=first_measurement['code-revision'],
-        checksum=first_measurement['code-checksum'],
-        latex=latex)
-
-    plotfile.flush()
-    plotfile.close()
-    if plot_type == 'animate':
-        print "Press enter to start animation."
-    call(["gnuplot", plotfile.name])
-    if pdfviewer:
+    if pdfviewer == 'anim':
+        plot_type = 'animate'
+        pdfviewer = None
+    elif pdfviewer == 'gradient':
+        plot_type = 'gradient'
+        pdfviewer = None
+    else:
+        plot_type = None
+
+    # the distributions are always gnuplot commands
+    renderer = None
+    if PLOT_BACKEND == 'matplotlib' and function == plot_benchmarks:
+        renderer = open_renderer(pool=parse_pool)
+        pipe = None
+    # the animation waits for enter from the terminal, not the pipe
+    own_pipe = (renderer is None and pipe is None and PLOT_PIPE and
+                plot_type != 'animate')
+    if own_pipe:
+        pipe = gnuplot.GnuplotPipe()
+
+    if renderer:
+        plotfile = renderer
+    elif pipe:
+        pipe.save_script(os.path.join(output_path, plot_filename))
+        plotfile = pipe
+    else:
+        plotfile = open(os.path.join(output_path, plot_filename), 'w')
+    metadata_file = open(os.path.join(
+        output_path, plot_prefix + '-metadata.txt'), 'w')
+
+    measurement_ids = " ".join(ids)
+    metadata_file.write("-*- mode: perf-report; -*-\n\n")
+    metadata_file.write("id: {0}\n".format(benchmark_group_id))
+    metadata_file.write("measurements: {0}\n".format(measurement_ids))
+    if sample:
+        metadata_file.write("approximate: sample of {0} rows per configuration\n".format(
+            sample))
+
+    if spilled is not None:
+        # the distributions read one partition at a time
+        benchmarks = (preprocess_benchmarks(partition, global_values, latex=latex)
+                      for partition in spilled.partitions())
+    elif function == plot_distributions:
+        benchmarks = [preprocess_benchmarks(benchmarks, global_values, latex=latex)]
+    else:
+        benchmarks = preprocess_benchmarks(benchmarks, global_values, latex=latex)
+
+    # the pages are numbered per group, and a sample has fewer rounds
+    # than the measurements
+    with current().derive(strict=current().strict and not sample) as session:
+        session.approximate = sample
+        function(
+            benchmarks,
+            output_filename,
+            None if pipe or renderer else PLOTPATH,
+            plotfile,
+            benchmark_group_id,
+            metadata_file,
+            plot_type=plot_type,
+            revision=first_measurement['code-revision'],
+            checksum=first_measurement['code-checksum'],
+            latex=latex)
+
+    metadata_file.close()
+    if spilled is not None:
+        spilled.close()
+    if renderer:
+        renderer.close()
+    elif pipe:
+        # most of the plots are already rendered
+        pipe.sync()
+        if own_pipe:
+            pipe.close()
+    else:
+        plotfile.flush()
+        plotfile.close()
+        if plot_type == 'animate':
+            print "Press enter to start animation."
+        call(["gnuplot", plotfile.name])
+    refine = sample and PLOT_REFINE
+    if pdfviewer and refine:
+        # the viewer is open while the exact plots replace the preview
+        Popen([pdfviewer, str(output_filename)])
+    elif pdfviewer:
         call([pdfviewer, str(output_filename)])
+    if refine:
+        print "Preview plot", str(output_filename)
+        print "Refining in the background..."
+        refine_in_background(
+            benchmark_group, method, measurement_path, output_path,
+            benchmark_group_id, latex=latex)
+        return output_filename
     print "Final plot",
     if 'animate' != plot_type:
         print str(output_filename)
     else:
         print str(plot_filename)
     print(benchmark_group_id)
+    return output_filename
+
+# the background process plotting the exact curves of the previews
+# and the queue of its groups
+refiner = None
+
+def refine_in_background(*args, **kwargs):
+    """
+    Plot a group again from all of its rows (the arguments of
+    process_measurement_group) in the background process, after the
+    groups queued before it. The previews of the following groups
+    are not held up.
+    """
+    global refiner
+    if refiner is None:
+        queue = Queue()
+        process = Process(target=run_refines, args=(queue,))
+        process.start()
+        refiner = (process, queue)
+    refiner[1].put((args, kwargs))
+
+def run_refines(queue):
+    for args, kwargs in iter(queue.get, None):
+        try:
+            process_measurement_group(*args, **kwargs)
+        except (AnalysisError, DatafileError) as e:
+            # the other groups are still refined
+            print e
+
+def finish_refines():
+    # wait for the queued groups to be refined
+    global refiner
+    if refiner is not None:
+        process, queue = refiner
+        queue.put(None)
+        process.join()
+        refiner = None
+
+USAGE = """
+    Usage: {0} input_path output_path limit [pdfviewer] [separate]
+           perf_select input_path output_path limit identifier [show-command]
+           perf_flame input_path output_path limit identifier
+           perf_diff input_path output_path limit identifier identifier
+"""
+
+def parse_arguments(argv):
+    if len(argv) < 4 or len(argv) > 6:
+        print argv[0]
+        print USAGE.format(argv[0])
+        exit(1)
+
+    options = {
+        'method': argv[0],
+        'measurement_path': os.path.normpath(argv[1]),
+        'output_path': argv[2],
+        'limit': argv[3],
+        'pdfviewer': None,
+        'latex': None,
+        'group': True,
+        'output_command': False,
+        'arguments': argv[4:]
+    }
+    if 'plotlatex' in options['method']:
+        options['latex'] = 'plotlatex'
+        options['method'] = 'curves'
+    elif 'plotsvg' in options['method']:
+        options['latex'] = 'plotsvg'
+        options['method'] = 'curves'
+
+    if len(argv) > 4:
+        options['pdfviewer'] = argv[4]
+    if len(argv) == 6:
+        options['output_command'] = argv[5] == 'show-command'
+        options['group'] = (not argv[5] == "separate")
+    return options
+
+def load_compatible_measurements(options):
+    sync_measurement_metadata(options['measurement_path'])
+    measurements = load_measurement_metadata(
+        options['measurement_path'], options['group'])
+    return filter(lambda x: int(x[0].get('repetitions', 0)) >= int(options['limit']),
+                  measurements.values())
+
+# ID = revision/checksum/class[/dynamic_size]
+def run_perf_select(options):
+    if not options['arguments']:
+        print USAGE.format(options['method'])
+        exit(1)
+    output_command = options['output_command']
+    if output_command:
+        # only the command may be printed
+        system_stdout = sys.stdout
+        system_stderr = sys.stderr
+        FNULL = open(os.devnull, 'w')
+        sys.stdout = FNULL
+        sys.stderr = FNULL
+    limited_measurements = load_compatible_measurements(options)
+    if output_command:
+        sys.stdout = system_stdout
+        sys.stderr = system_stderr
+        FNULL.close()
+    render_perf_reports_for_measurement(
+        options['arguments'][0], limited_measurements,
+        options['measurement_path'], options['output_path'],
+        output_command=output_command)
+
+def run_perf_flame(options):
+    if not options['arguments']:
+        print USAGE.format(options['method'])
+        exit(1)
+    render_flame_graph_for_measurement(
+        options['arguments'][0], load_compatible_measurements(options),
+        options['measurement_path'], options['output_path'])
+
+def run_perf_diff(options):
+    if len(options['arguments']) != 2:
+        print USAGE.format(options['method'])
+        exit(1)
+    render_profile_diff_for_measurements(
+        options['arguments'], load_compatible_measurements(options),
+        options['measurement_path'], options['output_path'])
+
+def run_plots(options):
+    method = options['method']
+    measurement_path = options['measurement_path']
+    output_path = options['output_path']
+    latex = options['latex']
+    pdfviewer = options['pdfviewer']
+    group = options['group']
+
+    limited_measurements = load_compatible_measurements(options)
+
+    # PLOT_ONLY: comma-separated glob patterns of the plot identifiers
+    # to output, eg. PLOT_ONLY='special-calls-utf-*,basic-call-*-fit'
+    if os.getenv('PLOT_ONLY'):
+        current().select = os.getenv('PLOT_ONLY').split(',')
+
+    csv_files = set()
+    # also the compressed datafiles
+    for f in glob.iglob(measurement_path + '/benchmarks-*.csv*'):
+        try:
+            csv_files.add(f.split('.csv')[0].split('benchmarks-')[1])
+        except IndexError:
+            pass
+
+    # PLOT_SELECT: process every matching group without prompting,
+    # eg. PLOT_SELECT=all or PLOT_SELECT=revision=abc123,since=2015-06-01
+    selection = os.getenv('PLOT_SELECT')
+    if not selection:
+        benchmark_group = choose_measurement_group(limited_measurements, csv_files)
+        benchmark_group_id = os.getenv('PLOT_ID', str(uuid.uuid4()))
+        # watch-device also pulls the new results from the device
+        if pdfviewer in ['watch', 'watch-device']:
+            watch_measurement_group(
+                benchmark_group, method, measurement_path, output_path,
+                benchmark_group_id, group=group, latex=latex,
+                from_device=(pdfviewer == 'watch-device'))
+            exit(0)
+        process_measurement_group(
+            benchmark_group, method, measurement_path, output_path,
+            benchmark_group_id, latex=latex, pdfviewer=pdfviewer,
+            sample=PLOT_PREVIEW)
+        finish_refines()
+        exit(0)
+
+    try:
+        criteria = parse_selection(selection)
+    except ValueError as e:
+        print e
+        exit(1)
+    selected = select_measurement_groups(limited_measurements, criteria)
+    print 'Selected {} of {} compatible measurements.'.format(
+        len(selected), len(limited_measurements))
+
+    pool = ThreadPool(SYNC_WORKERS)
+    parse_pool = Pool()
+    # one gnuplot for all the groups
+    pipe = gnuplot.GnuplotPipe() if PLOT_PIPE and pdfviewer != 'anim' else None
+    try:
+        for i, benchmark_group in enumerate(selected, 1):
+            print_measurement_group(i, benchmark_group, csv_files)
+            # one output directory per group, named after its first
+            # measurement so that a rerun replaces the earlier plots
+            benchmark_group_id = benchmark_group[0]['id']
+            group_output_path = os.path.join(output_path, benchmark_group_id)
+            if not os.path.isdir(group_output_path):
+                os.makedirs(group_output_path)
+            process_measurement_group(
+                benchmark_group, method, measurement_path, group_output_path,
+                benchmark_group_id, latex=latex, pdfviewer=pdfviewer,
+                pool=pool, parse_pool=parse_pool, pipe=pipe,
+                sample=PLOT_PREVIEW)
+    finally:
+        if pipe:
+            pipe.close()
+        pool.close()
+        parse_pool.close()
+        pool.join()
+        parse_pool.join()
+    finish_refines()
     exit(0)
+
+# the mode is chosen by the name of the symlink to this script
+MODES = odict([
+    ('perf_select', run_perf_select),
+    ('perf_flame', run_perf_flame),
+    ('perf_diff', run_perf_diff),
+    ('plotlatex', run_plots),
+    ('plotsvg', run_plots),
+    ('distributions', run_plots),
+    ('curves', run_plots)
+])
+
+def main(argv):
+    program = os.path.basename(argv[0])
+    for name, run in MODES.iteritems():
+        if name in program:
+            break
+    else:
+        print "Unknown mode {}, run through one of the links {}".format(
+            program, ', '.join(MODES))
+        exit(1)
+    try:
+        run(parse_arguments(argv))
+    except (AnalysisError, DatafileError) as e:
+        print e
+        exit(1)
+
+if __name__ == '__main__':
+    main(argv)
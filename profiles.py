@@ -0,0 +1,364 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import cgi
+import re
+import sys
+import zlib
+
+import numpy
+
+import textualtable
+
+# Parses the call graphs of `perf report --stdio -g graph,0,caller`
+# into folded stacks: "outermost;...;sampled function weight".
+# In graph mode the branch percentages are relative to all samples,
+# so the weight of a stack is its share of the samples, scaled to
+# the sample count from the report header when it is available.
+
+RE_SAMPLES = re.compile(r'^# Samples: (\d+)([KMG]?)')
+RE_ENTRY = re.compile(r'^\s+(\d+\.\d+)%\s+(?:\d+\.\d+%\s+)?.*?\[.\] (.*)$')
+RE_CALLCHAIN = re.compile(r'^([ |]*)(?:--(\d+\.\d+)%--|(---))?\s*(.*)$')
+
+SAMPLE_MULTIPLIERS = {'': 1, 'K': 1000, 'M': 1000000, 'G': 1000000000}
+
+
+class Frame(object):
+    __slots__ = ('symbol', 'weight', 'column', 'children')
+
+    def __init__(self, symbol, weight, column):
+        self.symbol = symbol
+        self.weight = weight
+        self.column = column
+        self.children = []
+
+
+def parse_report(f):
+    """
+    Returns the sample count (or None) and the call graph of every
+    report entry as a list of root frames.
+    """
+    samples = None
+    roots = []
+    entry = None
+    stack = []
+
+    for line in f:
+        line = line.rstrip('\n')
+        if line.startswith('#'):
+            m = RE_SAMPLES.match(line)
+            if m and samples is None:
+                samples = int(m.group(1)) * SAMPLE_MULTIPLIERS[m.group(2)]
+            continue
+        if line.strip() == '':
+            continue
+
+        m = RE_ENTRY.match(line)
+        if m:
+            entry = Frame(m.group(2).strip(), float(m.group(1)), -1)
+            roots.append(entry)
+            stack = [entry]
+            continue
+        if entry is None:
+            continue
+
+        m = RE_CALLCHAIN.match(line)
+        symbol = m.group(4).strip()
+        if symbol == '':
+            # pipes only
+            continue
+        percentage, chain_start = m.group(2), m.group(3)
+
+        # Frames are placed by the column where the next frame of
+        # their chain would be printed. Every level of branches is
+        # indented by a marker ('|' or ' ') and ten columns.
+        if chain_start:
+            # the chain replaces the bare entry
+            del stack[1:]
+            parent = stack[0]
+            weight = parent.weight
+            column = m.start(4)
+        elif percentage:
+            marker = len(m.group(1)) - 1
+            while len(stack) > 1 and stack[-1].column > marker + 1:
+                stack.pop()
+            parent = stack[-1]
+            weight = float(percentage)
+            column = marker + 11
+        else:
+            # next frame of the same chain
+            column = m.start(4)
+            while len(stack) > 1 and stack[-1].column > column:
+                stack.pop()
+            parent = stack[-1]
+            weight = parent.weight
+
+        frame = Frame(symbol, weight, column)
+        parent.children.append(frame)
+        stack.append(frame)
+
+    return samples, roots
+
+
+def folded_stacks(roots, scale=1.0):
+    """
+    Walk the call graphs and return the stacks and their self
+    weights as parallel lists.
+    """
+    stacks = []
+    weights = []
+
+    def walk(frame, path):
+        path = path + [frame.symbol]
+        self_weight = frame.weight - sum(c.weight for c in frame.children)
+        if self_weight > 0 and frame.children:
+            stacks.append(';'.join(path))
+            weights.append(self_weight * scale)
+        if not frame.children:
+            stacks.append(';'.join(path))
+            weights.append(frame.weight * scale)
+        for child in frame.children:
+            walk(child, path)
+
+    for entry in roots:
+        if not entry.children:
+            stacks.append(entry.symbol)
+            weights.append(entry.weight * scale)
+        for chain in entry.children:
+            walk(chain, [])
+
+    return stacks, weights
+
+
+def read_folded_report(path):
+    with open(path) as f:
+        samples, roots = parse_report(f)
+    scale = 1.0
+    if samples:
+        # percentages to samples
+        scale = samples / 100.0
+    return folded_stacks(roots, scale=scale)
+
+
+def merge_folded(profiles):
+    """
+    Sum the weights of identical stacks over several (stacks, weights)
+    profiles. Returns the stacks sorted and their weights as an array.
+    """
+    ids = {}
+    indices = []
+    all_weights = []
+    for stacks, weights in profiles:
+        indices.append(numpy.fromiter(
+            (ids.setdefault(s, len(ids)) for s in stacks),
+            dtype=numpy.intp, count=len(stacks)))
+        all_weights.append(numpy.asarray(weights, dtype=float))
+    if not ids:
+        return [], numpy.zeros(0)
+
+    totals = numpy.bincount(
+        numpy.concatenate(indices),
+        weights=numpy.concatenate(all_weights),
+        minlength=len(ids))
+
+    stacks = sorted(ids.iterkeys())
+    order = numpy.fromiter((ids[s] for s in stacks), dtype=numpy.intp, count=len(stacks))
+    return stacks, totals[order]
+
+
+def write_folded(out, stacks, weights):
+    for stack, weight in zip(stacks, weights):
+        if weight > 0:
+            out.write('{} {:.6g}\n'.format(stack, weight))
+
+
+FRAME_HEIGHT = 16
+FONT_SIZE = 11
+SVG_WIDTH = 1200
+MIN_FRAME_WIDTH = 0.1
+
+
+def frame_tree(stacks, weights):
+    # node: [weight, {symbol: child node}]
+    root = [0.0, {}]
+    for stack, weight in zip(stacks, weights):
+        root[0] += weight
+        node = root
+        for symbol in stack.split(';'):
+            node = node[1].setdefault(symbol, [0.0, {}])
+            node[0] += weight
+    return root
+
+
+def warm_color(symbol):
+    h = zlib.crc32(symbol) & 0xffffffff
+    return 'rgb({},{},{})'.format(
+        205 + h % 50, 80 + (h >> 8) % 150, (h >> 16) % 55)
+
+
+def write_flame_graph(out, stacks, weights, title='', color=None):
+    """
+    Write an SVG flame graph of folded stacks, outermost frames at
+    the bottom. `color` maps a stack (as a list of symbols) to a
+    fill color, by default a warm color per symbol.
+    """
+    root = frame_tree(stacks, weights)
+    total = root[0] or 1.0
+    scale = (SVG_WIDTH - 20.0) / total
+
+    def depth(node):
+        return 1 + max([depth(c) for c in node[1].itervalues()] or [0])
+
+    levels = depth(root) - 1
+    height = (levels + 3) * FRAME_HEIGHT
+
+    out.write('<?xml version="1.0" standalone="no"?>\n')
+    out.write('<svg version="1.1" width="{w}" height="{h}" '
+              'xmlns="http://www.w3.org/2000/svg" font-family="Verdana" '
+              'font-size="{fs}">\n'.format(w=SVG_WIDTH, h=height, fs=FONT_SIZE))
+    out.write('<rect x="0" y="0" width="{}" height="{}" fill="#f8f8f8"/>\n'.format(
+        SVG_WIDTH, height))
+    out.write('<text x="{}" y="{}" text-anchor="middle" font-size="{}">{}</text>\n'.format(
+        SVG_WIDTH / 2, FRAME_HEIGHT, FONT_SIZE + 3, cgi.escape(title)))
+
+    def draw(node, path, x, level):
+        for symbol, child in sorted(node[1].iteritems()):
+            width = child[0] * scale
+            if width >= MIN_FRAME_WIDTH:
+                child_path = path + [symbol]
+                y = height - (level + 1) * FRAME_HEIGHT
+                fill = color(child_path) if color else warm_color(symbol)
+                label = cgi.escape(symbol)
+                out.write('<g><title>{} ({:.2f}%)</title>'.format(
+                    label, 100.0 * child[0] / total))
+                out.write('<rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" '
+                          'fill="{}" rx="2" ry="2"/>'.format(
+                              10 + x, y, width, FRAME_HEIGHT - 1, fill))
+                chars = int(width / (FONT_SIZE * 0.6))
+                if chars >= 3:
+                    text = symbol if len(symbol) <= chars else symbol[:chars - 2] + '..'
+                    out.write('<text x="{:.1f}" y="{}">{}</text>'.format(
+                        13 + x, y + FRAME_HEIGHT - 4, cgi.escape(text)))
+                out.write('</g>\n')
+                draw(child, child_path, x, level + 1)
+            x += width
+
+    draw(root, [], 0.0, 0)
+    out.write('</svg>\n')
+
+
+# Call paths with at least this share of the samples are hot.
+HOT_PATH_SHARE = 1.0
+DIFF_ROWS = 30
+
+
+def normalized(stacks, weights):
+    # percentages of all samples
+    total = float(numpy.sum(weights)) or 1.0
+    return dict(zip(stacks, 100.0 * numpy.asarray(weights, dtype=float) / total))
+
+
+def symbol_shares(paths):
+    """
+    Self (sampled in the symbol) and total (symbol anywhere on the
+    stack) percentages of every symbol.
+    """
+    self_shares = {}
+    total_shares = {}
+    for stack, share in paths.iteritems():
+        symbols = stack.split(';')
+        self_shares[symbols[-1]] = self_shares.get(symbols[-1], 0.0) + share
+        for symbol in set(symbols):
+            total_shares[symbol] = total_shares.get(symbol, 0.0) + share
+    return self_shares, total_shares
+
+
+def prefix_shares(paths):
+    shares = {}
+    for stack, share in paths.iteritems():
+        symbols = stack.split(';')
+        for i in range(1, len(symbols) + 1):
+            prefix = ';'.join(symbols[:i])
+            shares[prefix] = shares.get(prefix, 0.0) + share
+    return shares
+
+
+def write_profile_diff(out, before, after, labels=('before', 'after'), rows=DIFF_ROWS):
+    """
+    Write symbol and call path level changes between two folded
+    profiles, (stacks, weights) each, as percentages of all samples.
+    """
+    paths_before = normalized(*before)
+    paths_after = normalized(*after)
+    self_before, total_before = symbol_shares(paths_before)
+    self_after, total_after = symbol_shares(paths_after)
+
+    symbols = set(total_before) | set(total_after)
+    symbol_rows = []
+    for symbol in symbols:
+        sb, sa = self_before.get(symbol, 0.0), self_after.get(symbol, 0.0)
+        tb, ta = total_before.get(symbol, 0.0), total_after.get(symbol, 0.0)
+        symbol_rows.append([symbol,
+                            '{:.2f}'.format(sb), '{:.2f}'.format(sa), '{:+.2f}'.format(sa - sb),
+                            '{:.2f}'.format(tb), '{:.2f}'.format(ta), '{:+.2f}'.format(ta - tb)])
+    symbol_rows.sort(key=lambda r: -abs(float(r[3])) - abs(float(r[6])))
+
+    out.write('Profile difference {} -> {}\n\n'.format(*labels))
+    out.write('Symbols (% of samples)\n')
+    out.write(textualtable.make_textual_table(
+        ['symbol', 'self ' + labels[0], 'self ' + labels[1], 'self delta',
+         'total ' + labels[0], 'total ' + labels[1], 'total delta'],
+        symbol_rows[:rows]))
+
+    stacks = set(paths_before) | set(paths_after)
+    changed = sorted(
+        ([paths_after.get(s, 0.0) - paths_before.get(s, 0.0), s] for s in stacks),
+        key=lambda r: -abs(r[0]))
+    out.write('\nCall paths (% of samples)\n')
+    out.write(textualtable.make_textual_table(
+        ['delta', labels[0], labels[1], 'path'],
+        [['{:+.2f}'.format(delta), '{:.2f}'.format(paths_before.get(s, 0.0)),
+          '{:.2f}'.format(paths_after.get(s, 0.0)), s]
+         for delta, s in changed[:rows]]))
+
+    new_paths = sorted((s for s in paths_after
+                        if paths_after[s] >= HOT_PATH_SHARE and s not in paths_before),
+                       key=lambda s: -paths_after[s])
+    vanished_paths = sorted((s for s in paths_before
+                             if paths_before[s] >= HOT_PATH_SHARE and s not in paths_after),
+                            key=lambda s: -paths_before[s])
+    out.write('\nNew hot paths\n')
+    for s in new_paths:
+        out.write('{:>8.2f}   {}\n'.format(paths_after[s], s))
+    out.write('\nVanished hot paths\n')
+    for s in vanished_paths:
+        out.write('{:>8.2f}   {}\n'.format(paths_before[s], s))
+
+
+def diff_color(before_shares, after_shares):
+    # red for frames that gained samples, blue for the ones that lost
+    def color(path):
+        prefix = ';'.join(path)
+        delta = after_shares.get(prefix, 0.0) - before_shares.get(prefix, 0.0)
+        intensity = int(min(abs(delta) / 5.0, 1.0) * 200)
+        if delta > 0:
+            return 'rgb(255,{0},{0})'.format(255 - intensity)
+        return 'rgb({0},{0},255)'.format(255 - intensity)
+    return color
+
+
+def write_diff_flame_graph(out, before, after, title=''):
+    """
+    A flame graph of the after profile, colored by the change of
+    each frame's share of the samples since the before profile.
+    """
+    before_shares = prefix_shares(normalized(*before))
+    after_shares = prefix_shares(normalized(*after))
+    write_flame_graph(out, after[0], after[1], title=title,
+                      color=diff_color(before_shares, after_shares))
+
+
+if __name__ == '__main__':
+    # profiles.py report... : print the merged folded stacks
+    profiles = [read_folded_report(path) for path in sys.argv[1:]]
+    write_folded(sys.stdout, *merge_folded(profiles))
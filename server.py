@@ -0,0 +1,436 @@
+#!/usr/bin/python
+
+import argparse
+import BaseHTTPServer
+import httplib
+import json
+import os
+import socket
+import SocketServer
+import StringIO
+import sys
+import threading
+import traceback
+import urllib
+import urlparse
+from collections import OrderedDict as odict
+
+from datafiles import datafile_path, DatafileError
+from devicesync import measurement_files
+import examine
+import perfindex
+import plot_data
+from session import Session, AnalysisError
+import textualtable
+import units
+
+# Keeps the preprocessed measurement groups in memory between
+# questions, so that only the first question about a group reads its
+# datafiles. The answers are computed from the cached datasets, in a
+# session of their own per request.
+
+DEFAULT_PORT = 8642
+# the most benchmark rows to keep cached
+DEFAULT_MAX_ROWS = 4000000
+# the cached answers count as a row per this many bytes
+ROW_BYTES = 500
+# the most answers to keep per group
+MAX_ANSWERS = 32
+
+OUTPUTS = {
+    'svg': 'plotsvg',
+    'latex': 'plotlatex'
+}
+
+
+class RequestError(Exception):
+    pass
+
+
+class CachedGroup(object):
+    """
+    A preprocessed measurement group and the answers computed from
+    it. The answers stay valid as long as the datafiles don't change,
+    and the least recently used are dropped after MAX_ANSWERS.
+    """
+    def __init__(self, benchmark_group, dataset, stamp):
+        self.benchmark_group = benchmark_group
+        self.dataset = dataset
+        self.stamp = stamp
+        self.answers = odict()
+        self.answer_bytes = 0
+        self.lock = threading.Lock()
+
+    def rows(self):
+        return len(self.dataset.benchmarks) + self.answer_bytes // ROW_BYTES
+
+    def answer(self, key, compute):
+        # the same question is computed only once
+        with self.lock:
+            try:
+                result = self.answers.pop(key)
+            except KeyError:
+                result = compute()
+                self.answer_bytes += answer_size(result)
+                while len(self.answers) >= MAX_ANSWERS:
+                    dropped_key, dropped = self.answers.popitem(last=False)
+                    self.answer_bytes -= answer_size(dropped)
+            # the most recently used last
+            self.answers[key] = result
+            return result
+
+
+def answer_size(result):
+    # the answers are strings or tuples of strings
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result)
+    return len(result)
+
+
+class GroupCache(object):
+    """
+    The least recently used groups are dropped when the cached groups
+    have more than max_rows rows, counting their answers.
+    """
+    def __init__(self, measurement_path, output_path, max_rows=DEFAULT_MAX_ROWS):
+        self.measurement_path = measurement_path
+        self.output_path = output_path
+        self.max_rows = max_rows
+        self.groups = odict()
+        self.lock = threading.Lock()
+        # a group is loaded by one request at a time
+        self.loading = {}
+        self.perf_index = None
+        # indexing the perf archives doesn't hold up the groups
+        self.perf_lock = threading.Lock()
+
+    def measurement_groups(self):
+        return plot_data.load_measurement_metadata(
+            self.measurement_path, True).values()
+
+    def find_group(self, mid):
+        for benchmark_group in self.measurement_groups():
+            if mid in [m['id'] for m in benchmark_group]:
+                return benchmark_group
+        raise RequestError('No measurement {}'.format(mid))
+
+    def datafiles(self, benchmark_group):
+        return [os.path.join(self.measurement_path, measurement_files(m)[0].local)
+                for m in benchmark_group]
+
+    def stamp(self, benchmark_group):
+        stamp = []
+        for path in self.datafiles(benchmark_group):
+            found = datafile_path(path)
+            if found is None:
+                raise RequestError('No datafile {}'.format(path))
+            stat = os.stat(found)
+            stamp.append((found, stat.st_mtime, stat.st_size))
+        return [m['id'] for m in benchmark_group], stamp
+
+    def cached(self, key):
+        with self.lock:
+            return key in self.groups
+
+    def get(self, mid, latex=None):
+        benchmark_group = self.find_group(mid)
+        key = (benchmark_group[0]['id'], latex)
+        stamp = self.stamp(benchmark_group)
+        with self.lock:
+            loading = self.loading.setdefault(key, threading.Lock())
+        with loading:
+            with self.lock:
+                group = self.groups.pop(key, None)
+                if group is not None and group.stamp == stamp:
+                    # the most recently used last
+                    self.groups[key] = group
+                    return group
+            with Session(plot_directory=self.output_path, debug_file=None) as session:
+                dataset = session.read(
+                    self.datafiles(benchmark_group),
+                    plot_data.measurement_values(benchmark_group),
+                    latex=latex)
+            group = CachedGroup(benchmark_group, dataset, stamp)
+            with self.lock:
+                self.groups[key] = group
+                self.evict()
+            return group
+
+    def answer(self, group, key, compute):
+        """The answer of group to key, computed if not cached."""
+        result = group.answer(key, compute)
+        with self.lock:
+            self.evict()
+        return result
+
+    def evict(self):
+        rows = sum(group.rows() for group in self.groups.itervalues())
+        while rows > self.max_rows and len(self.groups) > 1:
+            key, group = self.groups.popitem(last=False)
+            rows -= group.rows()
+            print 'Dropped {} from the cache'.format(key[0])
+
+    def perf_lookup(self, revision, class_, dynamic_size=None):
+        with self.perf_lock:
+            if self.perf_index is None:
+                self.perf_index = perfindex.load_index(self.measurement_path)
+            # only the new and changed archives are indexed
+            if perfindex.update_index(self.perf_index, self.measurement_groups(),
+                                      self.measurement_path, silent=True):
+                perfindex.save_index(self.perf_index, self.measurement_path)
+            return perfindex.lookup(self.perf_index, self.measurement_path,
+                                    revision, class_, dynamic_size)
+
+
+def parameter(params, name, default=None):
+    values = params.get(name)
+    if not values:
+        if default is None:
+            raise RequestError('Missing parameter {}'.format(name))
+        return default
+    return values[-1]
+
+
+def list_groups(cache, params):
+    groups = []
+    for benchmark_group in cache.measurement_groups():
+        first = benchmark_group[0]
+        groups.append({
+            'measurements': [m['id'] for m in benchmark_group],
+            'revision': first.get('code-revision'),
+            'tool': first.get('tool'),
+            'benchmark_set': first.get('benchmark-set'),
+            'device': first.get('device'),
+            'cached': any(cache.cached((first['id'], latex))
+                          for latex in [None] + OUTPUTS.values())
+        })
+    return 'application/json', json.dumps(groups, indent=2) + '\n'
+
+
+def plot_group(cache, params):
+    """
+    The gnuplot script (with the data inline) and the metadata of the
+    curves of a group, only the plots matching the comma-separated
+    patterns of only if given.
+    """
+    output = parameter(params, 'output', 'svg')
+    if output not in OUTPUTS:
+        raise RequestError('Unknown output {}'.format(output))
+    only = parameter(params, 'only', '')
+    select = only.split(',') if only else None
+    group = cache.get(parameter(params, 'group'), latex=OUTPUTS[output])
+
+    def compute():
+        script = StringIO.StringIO()
+        metadata = StringIO.StringIO()
+        first = group.benchmark_group[0]
+        dataset = group.dataset.using(Session(
+            plot_directory=cache.output_path, select=select, debug_file=None))
+        dataset.plot_all(
+            os.path.join(cache.output_path, 'plot-{}'.format(first['id'])),
+            script, metadata, first['id'],
+            revision=first['code-revision'], checksum=first['code-checksum'])
+        return script.getvalue(), metadata.getvalue()
+
+    return cache.answer(group, ('plot', output, only), compute)
+
+
+def plot_script(cache, params):
+    return 'text/plain', plot_group(cache, params)[0]
+
+
+def plot_tables(cache, params):
+    return 'text/plain', plot_group(cache, params)[1]
+
+
+def fit_series(cache, params):
+    """
+    The linear fits of the series of one plot spec, with the filters
+    of examine (eg. where=from=J) selecting the benchmarks.
+    """
+    group_key = parameter(params, 'group_by', 'id')
+    variable = parameter(params, 'variable', 'parameter_count')
+    measure = parameter(params, 'measure', 'response_time')
+    try:
+        filters = [examine.parse_filter(f) for f in params.get('where', [])]
+    except ValueError as e:
+        raise RequestError(e.args[0])
+    group = cache.get(parameter(params, 'group'))
+
+    def selected(benchmark):
+        for name, op, operand in filters:
+            if not op(benchmark.get(name), operand):
+                return False
+        return True
+
+    def compute():
+        from analysis import linear_fit
+        dataset = group.dataset.using(Session(debug_file=None))
+        data = dataset.extract(
+            select_predicate=selected, group=group_key,
+            variable=variable, measure=measure)
+        # the times are fitted in nanoseconds
+        unit = units.TIME_UNIT if measure in units.TIME_MEASURES else None
+        fits = []
+        for series in data:
+            headers, rows = plot_data.make_table(
+                series, group_key, variable, measure,
+                plot_data.plot_axes.get(variable, variable))
+            x, polys, residuals = linear_fit(rows)
+            fits.append(odict(
+                (header, {
+                    'slope': poly[0],
+                    'intercept': poly[1],
+                    'residual': residual,
+                    'unit': unit
+                }) for header, poly, residual in zip(headers[1:], polys, residuals)))
+        return json.dumps(fits, indent=2) + '\n'
+
+    key = ('fit', group_key, variable, measure, tuple(params.get('where', [])))
+    return 'application/json', cache.answer(group, key, compute)
+
+
+def perf_lookup(cache, params):
+    # an identifier of perf_select: revision/class[/dynamic_size]
+    path = parameter(params, 'identifier').split('/')
+    if len(path) not in [2, 3]:
+        raise RequestError('Invalid identifier {}'.format('/'.join(path)))
+    records = cache.perf_lookup(*path)
+    return 'text/plain', textualtable.make_textual_table(
+        ['filename', 'zip_path', 'member'],
+        [[r['filename'], r['zip_path'], r['member']] for r in records])
+
+
+HANDLERS = odict([
+    ('/groups', list_groups),
+    ('/plot', plot_script),
+    ('/table', plot_tables),
+    ('/fit', fit_series),
+    ('/perf', perf_lookup)
+])
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        handler = HANDLERS.get(url.path)
+        if handler is None:
+            return self.respond(404, 'text/plain', 'Requests: {}\n'.format(
+                ', '.join(HANDLERS)))
+        try:
+            content_type, body = handler(self.server.cache, urlparse.parse_qs(url.query))
+        except (RequestError, AnalysisError, DatafileError) as e:
+            return self.respond(400, 'text/plain', '{}\n'.format(e))
+        except Exception:
+            return self.respond(500, 'text/plain', traceback.format_exc())
+        self.respond(200, content_type, body)
+
+    def respond(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # the clients of a unix socket have no address to log
+        request, address = self.socket.accept()
+        return request, ('local', 0)
+
+
+def make_server(cache, port=DEFAULT_PORT, socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixServer(socket_path, RequestHandler)
+    else:
+        # only local clients
+        server = TCPServer(('127.0.0.1', port), RequestHandler)
+    server.cache = cache
+    return server
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, socket_path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def request(path, params, port=DEFAULT_PORT, socket_path=None):
+    """Returns the status and the body of the answer."""
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path)
+    else:
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+    try:
+        connection.request('GET', '{}?{}'.format(path, urllib.urlencode(params)))
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def parse_parameter(expression):
+    # name=value, the value may contain more =
+    name, sep, val = expression.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('Invalid parameter {}'.format(expression))
+    return name, val
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Answer questions about the measurements from the data '
+                    'kept in memory, or ask the server.')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-s', '--socket', default=None,
+                        help='listen on this unix socket instead of localhost')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('input_path')
+    serve_parser.add_argument('output_path', nargs='?', default='/tmp')
+    serve_parser.add_argument('-m', '--max-rows', type=int, default=DEFAULT_MAX_ROWS,
+                              help='the most benchmark rows to keep in memory, with the '
+                                   'answers counted as a row per {} bytes'.format(ROW_BYTES))
+    query_parser = subparsers.add_parser('query')
+    query_parser.add_argument('request', choices=[h[1:] for h in HANDLERS])
+    query_parser.add_argument('parameters', nargs='*', type=parse_parameter,
+                              help='name=value, eg. group=<measurement id> only=basic-call-*')
+    args = parser.parse_args()
+
+    if args.command == 'query':
+        try:
+            status, body = request('/' + args.request, args.parameters,
+                                   port=args.port, socket_path=args.socket)
+        except (socket.error, httplib.HTTPException) as e:
+            print 'Could not connect to the server: {}'.format(e)
+            sys.exit(1)
+        sys.stdout.write(body)
+        sys.exit(0 if status == 200 else 1)
+
+    cache = GroupCache(os.path.normpath(args.input_path), args.output_path,
+                       max_rows=args.max_rows)
+    server = make_server(cache, port=args.port, socket_path=args.socket)
+    print 'Serving {} on {}, press Ctrl-C to stop.'.format(
+        cache.measurement_path, args.socket or '127.0.0.1:{}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import threading
+
+# where the LaTeX and svg plots go by default
+PLOT_DIRECTORY = '/home/tituomin/gradu/paper/figures/plots'
+# the benchmarks of a failed round count check are written here
+DEBUG_FILE = '/tmp/debug.txt'
+
+
+class AnalysisError(Exception):
+    pass
+
+
+class Session(object):
+    """
+    The state of one analysis. The analysis functions use the session
+    that is active in the calling thread, and a thread without an
+    active session has a default one of its own, so analyses in
+    different threads do not share any state:
+
+        with Session(plot_directory=path) as session:
+            dataset = session.read(datafiles, global_values)
+            dataset.plot(plotscript, metadata_file, **spec)
+    """
+    def __init__(self, plot_directory=PLOT_DIRECTORY, select=None,
+                 strict=True, debug_file=DEBUG_FILE):
+        # the number of the last plot page output
+        self.page = 0
+        # the new benchmarks in watch mode, None to plot everything
+        self.changed = None
+        # glob patterns of the plot identifiers to output, None for all
+        self.select = select
+        # the sample size of a preview, None for the exact plots
+        self.approximate = None
+        # watch mode plots measurements that are still missing rounds
+        self.strict = strict
+        # the measurement the plots are labeled with
+        self.measurement_id = None
+        self.plot_directory = plot_directory
+        # None to not write the benchmarks of a failed check
+        self.debug_file = debug_file
+
+    def __enter__(self):
+        active_sessions().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        active_sessions().pop()
+        return False
+
+    def derive(self, **settings):
+        """
+        A new session with the settings of this one, changed by
+        settings, for an analysis that must not change this session.
+        """
+        values = dict(plot_directory=self.plot_directory, select=self.select,
+                      strict=self.strict, debug_file=self.debug_file)
+        values.update(settings)
+        return Session(**values)
+
+    def read(self, datafiles, global_values, latex=None, sample=None):
+        """
+        A dataset of the benchmarks in the datafiles (paths), with the
+        measurement values of global_values.
+        """
+        from datafiles import read_datafile, merge_datafiles
+        from plot_data import preprocess_benchmarks
+        benchmarks = merge_datafiles(
+            [read_datafile(path, sample=sample) for path in datafiles])
+        return Dataset(self, preprocess_benchmarks(
+            benchmarks, global_values, latex=latex), latex=latex)
+
+
+class Dataset(object):
+    """
+    The preprocessed benchmarks of a session. The plot specs are the
+    keyword arguments of plot_data.plot.
+    """
+    def __init__(self, session, benchmarks, latex=None):
+        self.session = session
+        self.benchmarks = benchmarks
+        self.latex = latex
+
+    def using(self, session):
+        """The same benchmarks in another session."""
+        return Dataset(session, self.benchmarks, latex=self.latex)
+
+    def extract(self, select_predicate=None, keys_to_remove=None,
+                group=None, variable=None, measure='response_time'):
+        """The series of the benchmarks selected by the spec."""
+        from plot_data import extract_data, without
+        with self.session:
+            return extract_data(
+                [without(keys_to_remove, b) for b in self.benchmarks
+                 if select_predicate is None or select_predicate(b)],
+                group=group, variable=variable, measure=measure)
+
+    def plot(self, plotscript, metadata_file, output='pdf', **spec):
+        """
+        Output one plot spec to plotscript (a file, a GnuplotPipe or a
+        gnuplot.Renderer), with the data inline.
+        """
+        from plot_data import plot
+        with self.session:
+            return plot(self.benchmarks, plotscript, None, metadata_file,
+                        output=output, **spec)
+
+    def plot_all(self, output, plotscript, metadata_file, bid,
+                 revision=None, checksum=None):
+        """All the curves, like the curves mode."""
+        from plot_data import plot_benchmarks
+        with self.session:
+            self.session.page = 0
+            plot_benchmarks(self.benchmarks, output, None, plotscript, bid,
+                            metadata_file, revision=revision,
+                            checksum=checksum, latex=self.latex)
+
+
+_local = threading.local()
+
+def active_sessions():
+    try:
+        return _local.sessions
+    except AttributeError:
+        sessions = _local.sessions = [Session()]
+        return sessions
+
+def current():
+    """The session active in this thread."""
+    return active_sessions()[-1]
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+from collections import OrderedDict as odict
+
+from datafiles import read_datafile, read_measurement_metadata, merge_datafiles
+from datafiles import typed_rows, DatafileError, value, datafile_path
+from datafiles import sample_lines, ROUND_KEYS
+import examine
+import textualtable
+
+# The measurement metadata and the rows of the local datafiles, so that
+# questions across measurements don't need to parse every datafile.
+DATABASE_FILE = 'measurements.db'
+MEASUREMENT_FILE = 'measurements.txt'
+
+# query names of the measurement columns; the other names are
+# benchmark columns
+MEASUREMENT_COLUMNS = odict([
+    ('measurement', 'id'),
+    ('revision', 'revision'),
+    ('checksum', 'checksum'),
+    ('tool', 'tool'),
+    ('device', 'device'),
+    ('benchmark_set', 'benchmark_set'),
+    ('started', 'started'),
+    ('ended', 'ended')
+])
+
+# computed from the benchmark columns, like format_direction does
+DERIVED_COLUMNS = {
+    'direction': (
+        "(CASE b.\"from\" WHEN 'J' THEN 'Java' ELSE b.\"from\" END)"
+        " || ' > ' || "
+        "(CASE b.\"to\" WHEN 'J' THEN 'Java' ELSE b.\"to\" END)")
+}
+
+INDEXED_COLUMNS = ['id', 'dynamic_size', 'parameter_count']
+
+SQL_OPERATORS = {
+    '!=': '!=',
+    '<=': '<=',
+    '>=': '>=',
+    '=': '=',
+    '<': '<',
+    '>': '>',
+    '~': 'LIKE'
+}
+
+AGGREGATES = ['min', 'max', 'avg', 'count']
+
+# the trailing comma of the datafiles gives an empty column
+RE_EMPTY_LABEL = re.compile('^empty_[0-9]+$')
+
+CREATE = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id TEXT PRIMARY KEY,
+    seq INTEGER,
+    revision TEXT,
+    checksum TEXT,
+    tool TEXT,
+    device TEXT,
+    benchmark_set TEXT,
+    started TEXT,
+    ended TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_revision ON measurements (revision);
+CREATE TABLE IF NOT EXISTS datafiles (
+    measurement_id TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    measurement_id TEXT,
+    lineno INTEGER
+);
+CREATE INDEX IF NOT EXISTS benchmarks_measurement ON benchmarks (measurement_id);
+"""
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def connect(measurement_path):
+    db = sqlite3.connect(os.path.join(measurement_path, DATABASE_FILE))
+    db.text_factory = str
+    db.executescript(CREATE)
+    return db
+
+
+def benchmark_columns(db):
+    return [row[1] for row in db.execute('PRAGMA table_info(benchmarks)')]
+
+
+def add_columns(db, labels):
+    columns = benchmark_columns(db)
+    for label in labels:
+        if label in columns or RE_EMPTY_LABEL.match(label):
+            continue
+        db.execute('ALTER TABLE benchmarks ADD COLUMN {}'.format(quote(label)))
+        columns.append(label)
+        if label in INDEXED_COLUMNS:
+            db.execute('CREATE INDEX IF NOT EXISTS {} ON benchmarks ({})'.format(
+                quote('benchmarks_' + label), quote(label)))
+    if 'from' in columns and 'to' in columns:
+        # the call direction
+        db.execute('CREATE INDEX IF NOT EXISTS benchmarks_direction '
+                   'ON benchmarks ("from", "to")')
+    return columns
+
+
+def measurement_order(measurement_path):
+    """
+    The positions of the measurements in the metadata index, which
+    the seq column keeps.
+    """
+    path = os.path.join(measurement_path, MEASUREMENT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        groups = read_measurement_metadata(f, False)
+    return dict(
+        (measurement['id'], seq) for seq, measurement in enumerate(
+            (m for group in groups.values() for m in group), 1))
+
+
+def store_measurement(db, seq, measurement):
+    # without a seq, a stored measurement keeps its own and a new one
+    # goes last
+    db.execute(
+        'INSERT OR REPLACE INTO measurements VALUES (?, COALESCE(?, '
+        '(SELECT seq FROM measurements WHERE id = ?), '
+        '(SELECT IFNULL(MAX(seq), 0) + 1 FROM measurements)), '
+        '?, ?, ?, ?, ?, ?, ?, ?)',
+        (measurement['id'], seq, measurement['id'],
+         measurement.get('code-revision'),
+         measurement.get('code-checksum'), measurement.get('tool'),
+         measurement.get('device'), measurement.get('benchmark-set'),
+         measurement.get('start'), measurement.get('end'),
+         json.dumps(measurement)))
+
+
+def store_datafile(db, mid, path):
+    labels, rows, keys_with_values = read_datafile(path)
+    labels = [l for l in labels if not RE_EMPTY_LABEL.match(l)]
+    add_columns(db, labels)
+    db.execute('DELETE FROM benchmarks WHERE measurement_id = ?', (mid,))
+    db.executemany(
+        'INSERT INTO benchmarks (measurement_id, lineno, {}) VALUES (?, ?, {})'.format(
+            ', '.join(quote(l) for l in labels), ', '.join('?' * len(labels))),
+        ([mid, row['lineno']] + [row[l] for l in labels] for row in rows))
+    return len(rows)
+
+
+def ingest(db, measurement_path, measurements, silent=False):
+    """
+    Store the metadata of the measurements (a list of groups as read by
+    read_measurement_metadata) and the rows of their local datafiles
+    that are new or have changed since they were stored. The
+    measurements are ordered by their position in the metadata index
+    of measurement_path, also when only some of them are stored.
+    """
+    order = measurement_order(measurement_path)
+    for group in measurements:
+        for measurement in group:
+            store_measurement(db, order.get(measurement['id']), measurement)
+            mid = measurement['id']
+            path = os.path.join(measurement_path, 'benchmarks-{}.csv'.format(mid))
+            # the datafile may have been compressed since
+            found = datafile_path(path)
+            if found is None:
+                continue
+            stat = os.stat(found)
+            stored = db.execute(
+                'SELECT mtime, size FROM datafiles WHERE measurement_id = ?',
+                (mid,)).fetchone()
+            if stored == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                count = store_datafile(db, mid, path)
+            except DatafileError as e:
+                print e
+                continue
+            db.execute('INSERT OR REPLACE INTO datafiles VALUES (?, ?, ?)',
+                       (mid, stat.st_mtime, stat.st_size))
+            if not silent:
+                print 'Stored {} rows of {}'.format(count, mid)
+    db.commit()
+
+
+def read_benchmarks(db, measurement_ids, sample=None):
+    """
+    The benchmarks of the measurements like datafiles.read_datafiles
+    reads them from the datafiles, or a sample of them like
+    datafiles.sample_lines.
+    """
+    labels = [c for c in benchmark_columns(db) if c not in ['measurement_id', 'lineno']]
+    parts = []
+    for mid in measurement_ids:
+        cursor = db.execute(
+            'SELECT {} FROM benchmarks WHERE measurement_id = ? ORDER BY lineno'.format(
+                ', '.join(quote(c) for c in labels)), (mid,))
+        # the stored values were parsed when they were stored
+        rows = cursor.fetchall()
+        if sample:
+            rows = sample_lines(labels, rows, sample, fields=tuple)
+        if rows:
+            benchmarks, keys_with_values = typed_rows(labels, rows)
+            parts.append((labels, benchmarks, keys_with_values))
+    return merge_datafiles(parts)
+
+
+def read_minimums(db, measurement_ids, measure='response_time'):
+    """
+    One benchmark per configuration of the measurements (the rows
+    with the same values in all but the ROUND_KEYS), with the minimum
+    of measure over its rounds and their number in rounds.
+    """
+    columns = [c for c in benchmark_columns(db) if c not in ['measurement_id', 'lineno']]
+    configuration = [c for c in columns if c not in ROUND_KEYS]
+    # with one MIN, sqlite takes the other round keys from the row
+    # that has the minimum
+    cursor = db.execute(
+        'SELECT {}, COUNT(*) FROM benchmarks WHERE measurement_id IN ({}) '
+        'GROUP BY {}'.format(
+            ', '.join('MIN({})'.format(quote(c)) if c == measure else quote(c)
+                      for c in columns),
+            ', '.join('?' * len(measurement_ids)),
+            ', '.join(quote(c) for c in configuration)),
+        list(measurement_ids))
+    labels = columns + ['rounds']
+    benchmarks, keys_with_values = typed_rows(labels, cursor)
+    return merge_datafiles([(labels, benchmarks, keys_with_values)])
+
+
+def column(name):
+    if name in MEASUREMENT_COLUMNS:
+        return 'm.' + quote(MEASUREMENT_COLUMNS[name])
+    if name in DERIVED_COLUMNS:
+        return DERIVED_COLUMNS[name]
+    return 'b.' + quote(name)
+
+
+def aggregate(db, measure, group_by=[], filters=[], function='min',
+              latest=False, limit=None):
+    """
+    The aggregate of the measure over the benchmarks matching the
+    filters ((name, operator, operand) as parsed by examine.parse_filter,
+    with operators from SQL_OPERATORS), grouped by group_by. With
+    latest, the groups of the most recent measurements come first.
+    Returns (headers, rows).
+    """
+    where = []
+    params = []
+    for name, op, operand in filters:
+        if op == '~':
+            operand = '%{}%'.format(operand)
+        where.append('{} {} ?'.format(column(name), SQL_OPERATORS[op]))
+        params.append(operand)
+
+    keys = [column(name) for name in group_by]
+    sql = 'SELECT {} FROM benchmarks b JOIN measurements m ON b.measurement_id = m.id'.format(
+        ', '.join(keys + ['{}({})'.format(function.upper(), column(measure)),
+                          'COUNT(*)']))
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if keys:
+        sql += ' GROUP BY ' + ', '.join(keys)
+        if latest:
+            sql += ' ORDER BY MAX(m.seq) DESC'
+        else:
+            sql += ' ORDER BY ' + ', '.join(keys)
+    if limit:
+        sql += ' LIMIT {:d}'.format(limit)
+
+    headers = list(group_by) + ['{}({})'.format(function, measure), 'count']
+    return headers, [list(row) for row in db.execute(sql, params)]
+
+
+def parse_filter(expression):
+    m = examine.RE_FILTER.match(expression)
+    if not m:
+        raise ValueError('Invalid filter {}'.format(expression))
+    name, op, operand = m.groups()
+    if op != '~':
+        operand = value(operand, key=name)
+    return name, op, operand
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Store measurements in a local database and query them.')
+    parser.add_argument('command', choices=['ingest', 'query'])
+    parser.add_argument('input_path')
+    parser.add_argument('measure', nargs='?', default='response_time')
+    parser.add_argument('-w', '--where', action='append', default=[],
+                        help='filter: field=value, field!=value, field<value, '
+                             'field<=value, field>value, field>=value or field~substring')
+    parser.add_argument('-g', '--group-by', action='append', default=[],
+                        help='benchmark fields, or ' + ', '.join(MEASUREMENT_COLUMNS))
+    parser.add_argument('-a', '--aggregate', choices=AGGREGATES, default='min')
+    parser.add_argument('-l', '--latest', action='store_true',
+                        help='most recent measurements first')
+    parser.add_argument('-n', '--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    measurement_path = os.path.normpath(args.input_path)
+    db = connect(measurement_path)
+    try:
+        if args.command == 'ingest':
+            with open(os.path.join(measurement_path, MEASUREMENT_FILE)) as f:
+                measurements = read_measurement_metadata(f, False)
+            ingest(db, measurement_path, measurements.values())
+            sys.exit(0)
+
+        try:
+            headers, rows = aggregate(
+                db, args.measure,
+                group_by=[g for arg in args.group_by for g in arg.split(',')],
+                filters=[parse_filter(f) for f in args.where],
+                function=args.aggregate,
+                latest=args.latest,
+                limit=args.limit)
+        except (ValueError, sqlite3.OperationalError) as e:
+            print e
+            sys.exit(1)
+        sys.stdout.write(textualtable.make_textual_table(
+            headers, [[examine.display(v) for v in row] for row in rows]))
+    finally:
+        db.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+# python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_PATH))
+
+import devicesync
+from datafiles import read_measurement_metadata
+
+DEVICE_PATH = '/sdcard/results'
+MEASUREMENT_FILE = 'measurements.txt'
+
+MEASUREMENT = """
+id: {id}
+code-revision: {revision}
+code-checksum: c1
+repetitions: 10
+rounds: 1
+tool: Tool
+benchmark-set: NOALLOC
+logfile: log-{id}.txt
+"""
+
+
+def metadata(*measurements):
+    return ''.join(MEASUREMENT.format(id=mid, revision=revision)
+                   for mid, revision in measurements) + '\n'
+
+
+class DeviceSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='fake-adb-')
+        self.host_path = tempfile.mkdtemp(prefix='host-')
+        os.environ['FAKE_ADB_ROOT'] = self.root
+        self.adb = devicesync.ADB
+        devicesync.ADB = os.path.join(TESTS_PATH, 'fake_adb')
+
+    def tearDown(self):
+        devicesync.ADB = self.adb
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.host_path)
+
+    def device_file(self, serial, filename, content):
+        path = os.path.join(self.root, serial, DEVICE_PATH.lstrip('/'), filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def host_file(self, filename, content):
+        with open(os.path.join(self.host_path, filename), 'w') as f:
+            f.write(content)
+
+    def sync(self):
+        devicesync.sync_devices(DEVICE_PATH, self.host_path, MEASUREMENT_FILE,
+                                devicesync.list_devices())
+        with open(os.path.join(self.host_path, MEASUREMENT_FILE)) as f:
+            groups = read_measurement_metadata(f, False)
+        return dict((m['id'], m) for group in groups.values() for m in group)
+
+    def test_list_devices(self):
+        self.device_file('S1', MEASUREMENT_FILE, '')
+        self.device_file('S2', MEASUREMENT_FILE, '')
+        self.assertEqual(devicesync.list_devices(), ['S1', 'S2'])
+
+    def test_devices_are_merged_with_namespaced_ids(self):
+        self.device_file('S1', MEASUREMENT_FILE, metadata(('m1', 'r1')))
+        self.device_file('S2', MEASUREMENT_FILE, metadata(('m1', 'r1')))
+        measurements = self.sync()
+        self.assertEqual(sorted(measurements), ['S1-m1', 'S2-m1'])
+        for serial in ['S1', 'S2']:
+            measurement = measurements[serial + '-m1']
+            self.assertEqual(measurement['device'], serial)
+            self.assertEqual(measurement['device-id'], 'm1')
+            self.assertEqual(measurement['logfile'], serial + '-log-m1.txt')
+
+    def test_files_are_pulled_from_their_device(self):
+        self.device_file('S1', MEASUREMENT_FILE, metadata(('m1', 'r1')))
+        self.device_file('S2', MEASUREMENT_FILE, metadata(('m2', 'r1')))
+        self.device_file('S1', 'benchmarks-m1.csv', 'S1 data\n')
+        self.device_file('S2', 'benchmarks-m2.csv', 'S2 data\n')
+        measurements = self.sync()
+        transfers = [devicesync.measurement_files(measurements[mid])[0]
+                     for mid in ['S1-m1', 'S2-m2']]
+        self.assertEqual(
+            devicesync.sync_files(DEVICE_PATH, self.host_path, transfers, silent=True), [])
+        with open(os.path.join(self.host_path, 'benchmarks-S2-m2.csv')) as f:
+            self.assertEqual(f.read(), 'S2 data\n')
+
+    def test_single_device_measurements_keep_their_ids(self):
+        # synced before from the only attached device
+        self.host_file(MEASUREMENT_FILE, metadata(('m1', 'r1'), ('m3', 'r1')))
+        self.device_file('S1', MEASUREMENT_FILE, metadata(('m4', 'r1')))
+        self.device_file('S2', MEASUREMENT_FILE, metadata(('m1', 'r1'), ('m2', 'r1')))
+        self.device_file('S2', 'benchmarks-m1.csv', 'S2 data\n')
+        measurements = self.sync()
+        self.assertEqual(sorted(measurements), ['S1-m4', 'S2-m2', 'm1', 'm3'])
+        # found on a device: its files are pulled from that device, also
+        # when there are several
+        self.assertEqual(measurements['m1']['device'], 'S2')
+        transfer = devicesync.measurement_files(measurements['m1'])[0]
+        self.assertEqual(transfer, devicesync.Transfer('S2', 'benchmarks-m1.csv',
+                                                       'benchmarks-m1.csv'))
+        self.assertEqual(
+            devicesync.sync_files(DEVICE_PATH, self.host_path, [transfer], silent=True), [])
+        # on none of the several devices
+        self.assertEqual(measurements['m3'].get('device'), None)
+
+        # the devices stay assigned in later syncs
+        self.assertEqual(self.sync()['m1']['device'], 'S2')
+
+    def test_single_device_measurements_go_to_the_only_device(self):
+        self.host_file(MEASUREMENT_FILE, metadata(('m1', 'r1')))
+        self.device_file('S1', MEASUREMENT_FILE, metadata(('m2', 'r1')))
+        measurements = self.sync()
+        self.assertEqual(sorted(measurements), ['S1-m2', 'm1'])
+        self.assertEqual(measurements['m1']['device'], 'S1')
+
+
+if __name__ == '__main__':
+    unittest.main()
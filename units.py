@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+from datafiles import DatafileError
+
+# The times are kept as integer nanoseconds from preprocessing on, so
+# that the aggregates and the fits are computed from the exact values.
+# They are scaled to seconds only for the output.
+
+# nanoseconds in one unit of the time_unit column
+TIME_UNITS = {
+    'nanoseconds': 1,
+    'microseconds': 1000,
+    'milliseconds': 1000000,
+    'seconds': 1000000000
+}
+
+# the unit of the times after preprocessing
+TIME_UNIT = 'nanoseconds'
+
+# the measures that are times
+TIME_MEASURES = ['response_time']
+
+# seconds in a nanosecond
+SCALE = 1e-9
+
+
+def nanoseconds(value, unit):
+    if value is None:
+        return None
+    try:
+        scale = TIME_UNITS[unit]
+    except KeyError:
+        raise DatafileError('Unknown time unit {}'.format(unit))
+    # the fractions of a nanosecond are below the resolution
+    return int(round(value * scale))
+
+
+def seconds(value):
+    if value is None:
+        return None
+    return value * SCALE
+
+
+def seconds_rows(rows, measure):
+    """
+    The rows of a table (a variable value and a value per series) with
+    the values in seconds if the measure is a time.
+    """
+    if measure not in TIME_MEASURES or not rows:
+        return rows
+    import numpy
+    # the missing values are nan
+    values = numpy.array([row[1:] for row in rows], dtype=float) * SCALE
+    return [
+        [row[0]] + [None if v != v else v for v in scaled]
+        for row, scaled in zip(rows, values.tolist())]